@@ -0,0 +1,44 @@
+"""
+Compares building content streams with str.format and encode per operator
+against the bytearray backed ContentStream, in time and stream size.
+
+    python benchmarks/content.py [operators]
+"""
+import sys
+from random import Random
+from time import perf_counter
+from bericht.pdf.content import ContentStream
+
+OPERATORS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+random = Random(42)
+values = [
+    (random.uniform(0, 600), random.uniform(0, 800), random.uniform(0, 200), random.uniform(0, 20))
+    for _ in range(OPERATORS // 4)
+]
+
+
+def formatted():
+    chunks = []
+    for x, y, width, height in values:
+        chunks.append("1 0 0 1 {} {} Tm\n".format(x, y).encode())
+        chunks.append("{} {} Td\n".format(width, -height).encode())
+        chunks.append("n {} {} {} {} re f*\n".format(x, y, width, height).encode())
+        chunks.append("({}) Tj ".format('hello world').encode())
+    return b''.join(chunks)
+
+
+def built():
+    stream = ContentStream()
+    for x, y, width, height in values:
+        stream.op(b'Tm', 1, 0, 0, 1, x, y)
+        stream.op(b'Td', width, -height)
+        stream.op(b're f*', x, y, width, height)
+        stream.show('hello world')
+    return bytes(stream)
+
+
+for name, build in (('str.format + encode', formatted), ('ContentStream', built)):
+    start = perf_counter()
+    size = len(build())
+    print('{:<22} {:>7.3f}s {:>12,} bytes'.format(name, perf_counter() - start, size))
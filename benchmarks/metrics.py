@@ -0,0 +1,41 @@
+"""
+Compares getting ready to measure text in a TrueType font by parsing it
+with reportlab against mapping its precompiled metrics file.
+
+    python benchmarks/metrics.py [font.ttf]
+
+Only measuring is covered: drawing text in the font still needs it
+registered with reportlab, which parses the whole file.
+"""
+import os
+import sys
+import tempfile
+from time import perf_counter
+from reportlab.pdfbase.ttfonts import TTFont
+from bericht.html.metrics import FontMetrics
+
+PATH = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+    os.path.dirname(__file__), '..', 'tests', 'fonts', 'Ubuntu-Regular.ttf'
+)
+RUNS = 20
+TEXT = 'The quick brown fox jumps over the lazy dog, Grüße €1.234,56 ' * 20
+
+
+def parsed():
+    font = TTFont('Benchmark', PATH)
+    return font.stringWidth(TEXT, 10)
+
+
+def mapped(path):
+    return FontMetrics.load(path).string_width(TEXT, 10)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'Benchmark.metrics')
+    FontMetrics.from_font(TTFont('Benchmark', PATH)).save(path)
+    assert parsed() == mapped(path)
+    for name, ready in (('TTFont', parsed), ('FontMetrics.load', lambda: mapped(path))):
+        start = perf_counter()
+        for _ in range(RUNS):
+            ready()
+        print('{:<18} {:>8.2f}ms per font'.format(name, (perf_counter() - start) / RUNS * 1000))
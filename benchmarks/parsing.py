@@ -0,0 +1,40 @@
+"""
+Compares two pass parsing (default) against single pass parsing with
+a bounded lookahead window for column measurement.
+
+    python benchmarks/parsing.py [rows]
+"""
+import sys
+from time import perf_counter
+from bericht.html import HTMLParser, CSS
+from bericht.pdf import PDFStreamer
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+css = CSS("""
+td { border-width: 1px; padding: 2px; }
+""")
+
+
+def html():
+    yield '<table><colgroup><col width="0*"><col width="1*"><col width="0*"></colgroup>'
+    yield '<thead><tr><td>#<td>description<td>amount</tr></thead>'
+    for i in range(ROWS):
+        yield '<tr><td>{}<td>row {} description<td>{}.00</tr>'.format(i, i, i * 3)
+    yield '</table>'
+
+
+def run(lookahead):
+    start = perf_counter()
+    first_page = None
+    chunks = iter(PDFStreamer(HTMLParser(html, css, lookahead)))
+    next(chunks)  # header
+    for _ in chunks:
+        if first_page is None:
+            first_page = perf_counter() - start
+    return perf_counter() - start, first_page
+
+
+for name, lookahead in (('two pass', None), ('single pass (lookahead=50)', 50)):
+    total, first = run(lookahead)
+    print('{:<28} total {:>7.3f}s   first page {:>7.3f}s'.format(name, total, first))
@@ -0,0 +1,43 @@
+"""
+Compares wrapping a long paragraph with every word measured by reportlab's
+stringWidth on each access against the width tables, at a few widths.
+
+    python benchmarks/wrap.py [words]
+"""
+import sys
+from random import Random
+from time import perf_counter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from bericht.html import HTMLParser, CSS
+from bericht.html.box import StyledPart, Word
+from bericht.pdf import PDFDocument
+
+WORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+WIDTHS = (450, 300, 150)
+
+random = Random(42)
+vocabulary = ['lorem', 'ipsum', 'dolor', 'Grüße', 'Straße', '€1.234,56', 'amet', 'consectetur', 'Σ']
+text = ' '.join(random.choice(vocabulary) for _ in range(WORDS))
+css = CSS("p { font-family: Helvetica; font-size: 10px; }")
+
+
+def wrap():
+    paragraph = next(iter(HTMLParser(lambda: iter(['<p>', text, '</p>']), css)))
+    page = PDFDocument(css).add_page()
+    start = perf_counter()
+    lines = [paragraph.wrap(page, width)[1] for width in WIDTHS]
+    return perf_counter() - start, lines
+
+
+tables, lines = wrap()
+
+width, space_width = StyledPart.width, Word.space_width
+StyledPart.width = property(lambda part: stringWidth(part.part, part.style.font_name, part.style.font_size))
+Word.space_width = property(lambda word: StyledPart(word.parts[-1].style, ' ').width)
+reportlab, reportlab_lines = wrap()
+StyledPart.width, Word.space_width = width, space_width
+
+assert lines == reportlab_lines
+print('{} words wrapped at {} points'.format(WORDS, ', '.join(map(str, WIDTHS))))
+print('{:<22} {:>7.3f}s'.format('reportlab stringWidth', reportlab))
+print('{:<22} {:>7.3f}s'.format('width tables', tables))
@@ -1,6 +1,7 @@
 from copy import copy
 from string import whitespace
-from reportlab.pdfbase.pdfmetrics import stringWidth, getFont, getAscentDescent
+from reportlab.pdfbase.pdfmetrics import getFont, getAscentDescent
+from .metrics import measure
 from .style import TextAlign, default as default_style, VerticalAlign
 
 __all__ = ('Box', 'Block', 'Inline', 'ListItem')
@@ -23,16 +24,13 @@ class StyledPart:
 
     @property
     def width(self):
-        return stringWidth(self.part, self.style.font_name, self.style.font_size)
+        return measure(self.part, self.style)
 
     @property
     def height(self):
         return self.style.leading
 
 
-SPACE_WIDTH_CACHE = {}
-
-
 class Word:
     __slots__ = ('parts',)
 
@@ -56,10 +54,7 @@ class Word:
 
     @property
     def space_width(self):
-        args = (self.parts[-1].style.font_name, self.parts[-1].style.font_size)
-        if args not in SPACE_WIDTH_CACHE:
-            SPACE_WIDTH_CACHE[args] = stringWidth(' ', *args)
-        return SPACE_WIDTH_CACHE[args]
+        return measure(' ', self.parts[-1].style)
 
     def __str__(self):
         return ''.join(p.part for p in self.parts)
@@ -311,30 +306,26 @@ class Behavior:
         return final_x, final_y
 
     def draw_border_and_background(self, page, x, y):
-        page.save_state()
-        page.translate(x, y)
-        s, width, height = self.box.style, self.box.width, self.box.height
-        top_left, top_right, bottom_left, bottom_right = self.border_box
+        self.draw_background(page, x, y)
+        self.draw_border(page, x, y)
+
+    def draw_background(self, page, x, y):
+        s = self.box.style
         if s.background_color:
-            page.fill_color(*s.background_color)
-            page.rectangle(0, 0, width, height)
-        if s.border_top_width > 0:
-            page.line_width(s.border_top_width)
-            page.stroke_color(*s.border_top_color)
-            page.line(*top_left, *top_right)
-        if s.border_right_width > 0:
-            page.line_width(s.border_right_width)
-            page.stroke_color(*s.border_right_color)
-            page.line(*top_right, *bottom_right)
+            page.borders.fill(s.background_color, x, y, self.box.width, self.box.height)
+
+    def draw_border(self, page, x, y, left=True, right=True, top=True):
+        s, borders = self.box.style, page.borders
+        (left_x, top_y), (right_x, _), (_, bottom_y), _ = self.border_box
+        left_x, right_x, top_y, bottom_y = x+left_x, x+right_x, y+top_y, y+bottom_y
+        if top and s.border_top_width > 0:
+            borders.edge(s.border_top_color, s.border_top_width, left_x, top_y, right_x, top_y)
+        if right and s.border_right_width > 0:
+            borders.edge(s.border_right_color, s.border_right_width, right_x, top_y, right_x, bottom_y)
         if s.border_bottom_width > 0:
-            page.line_width(s.border_bottom_width)
-            page.stroke_color(*s.border_bottom_color)
-            page.line(*bottom_left, *bottom_right)
-        if s.border_left_width > 0:
-            page.line_width(s.border_left_width)
-            page.stroke_color(*s.border_left_color)
-            page.line(*top_left, *bottom_left)
-        page.restore_state()
+            borders.edge(s.border_bottom_color, s.border_bottom_width, left_x, bottom_y, right_x, bottom_y)
+        if left and s.border_left_width > 0:
+            borders.edge(s.border_left_color, s.border_left_width, left_x, top_y, left_x, bottom_y)
 
 
 class Block(Behavior):
@@ -445,6 +436,16 @@ class Box:
         if words:
             yield from words
 
+    def fingerprint(self, digest):
+        """ Feeds the tags, attributes and text of the box and its descendants into `digest`. """
+        digest.update('<{} {}>'.format(self.tag, sorted(self.attrs.items())).encode())
+        for child in self.children:
+            if isinstance(child, Box):
+                child.fingerprint(digest)
+            else:
+                digest.update('{}\0'.format(child).encode())
+        digest.update(b'</>')
+
     def wrap(self, page, available_width):
         return self.behavior.wrap(page, available_width)
 
@@ -203,14 +203,52 @@ def parse_value_parts(tokens):
     return list(filter(lambda token: token.type not in ('whitespace', 'comment'), tokens))
 
 
+class Counter:
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, page):
+        if self.name == 'pages':
+            # total so far, the final count is only known once the document is complete
+            return page.document.page_count
+        return page.page_number
+
+
+class ContentValue:
+    """
+    Value of the `content` property, called with a page it returns the text.
+    `parts` are strings and counters, the counters change from page to page.
+    """
+
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    @property
+    def static(self):
+        return all(isinstance(part, str) for part in self.parts)
+
+    def __call__(self, page):
+        return ''.join(
+            [p if isinstance(p, str) else str(p(page)) for p in self.parts]
+        )
+
+
 def parse_content_value(value):
     parts = []
     for part in value:
         if isinstance(part, ast.StringToken):
-            parts.append(part.value)
+            if parts and isinstance(parts[-1], str):
+                parts[-1] += part.value
+            else:
+                parts.append(part.value)
         elif isinstance(part, ast.FunctionBlock):
-            if part.lower_name == 'counter' and part.arguments[0].lower_value == 'page':
-                parts.append(lambda page: page.page_number)
+            if part.lower_name == 'counter' and part.arguments[0].lower_value in ('page', 'pages'):
+                parts.append(Counter(part.arguments[0].lower_value))
             else:
                 raise NotImplementedError
         elif isinstance(part, ast.WhitespaceToken):
@@ -218,9 +256,7 @@ def parse_content_value(value):
         else:
             raise NotImplementedError
 
-    return lambda page: ''.join(
-        [p if isinstance(p, str) else str(p(page)) for p in parts]
-    )
+    return ContentValue(parts)
 
 
 def parse_selectors(prelude):
@@ -294,6 +330,9 @@ class CSS:
     def __init__(self, src):
         self.src = src
         self.rules = []
+        self.page_rules = []
+        # (base style, matched @page rules) -> page style
+        self.page_styles = {}
         with open(join(dirname(__file__), 'html.css'), 'r') as html_css:
             self.parse(html_css.read())
         self.parse(src)
@@ -309,7 +348,7 @@ class CSS:
                         combinator = Combinator()
                         combinator.add(combinator.select_tag, '@page')
                         selector.combinators.append(combinator)
-                self.rules.append(
+                self.page_rules.append(
                     (selectors, Declarations(rule.content))
                 )
             elif isinstance(rule, ast.QualifiedRule):
@@ -323,6 +362,20 @@ class CSS:
                 if selector.matches(node):
                     declarations.apply(node)
 
+    def apply_page(self, page):
+        """ Applies the @page rules, pages matching the same rules share their style. """
+        matched = tuple(
+            i for i, (selectors, _) in enumerate(self.page_rules)
+            if any(selector.matches(page) for selector in selectors)
+        )
+        key = page.style, matched
+        style = self.page_styles.get(key)
+        if style is None:
+            for i in matched:
+                self.page_rules[i][1].apply(page)
+            style = self.page_styles[key] = page.style
+        page.style = style
+
     def apply_recursively(self, node):
         self.apply(node)
         for child in node.children:
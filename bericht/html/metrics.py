@@ -0,0 +1,236 @@
+"""
+Width tables text is measured with, built from the font when first used.
+They can be precompiled into a file which is memory mapped when loaded,
+so processes measure text without parsing the font and share the tables.
+
+    python -m bericht.html.metrics Helvetica fonts/Ubuntu-Regular.ttf -o metrics/
+
+Fonts are given by the name of a registered (or standard Type1) font or
+the path of a TrueType file, each is compiled to `<font name>.metrics`.
+
+Metrics only cover measuring: text is drawn and subsets are embedded by
+the reportlab font, so a TrueType font still has to be registered, and is
+parsed, in processes drawing pages. Ascent and descent are kept for
+callers, layout takes line heights from the style's leading.
+"""
+import os
+import sys
+import mmap
+import struct
+import argparse
+from array import array
+from collections import OrderedDict
+from itertools import chain, groupby
+from reportlab.pdfbase.pdfmetrics import getFont
+from reportlab.pdfbase.ttfonts import TTFont
+
+__all__ = ('FontMetrics', 'register', 'font_metrics', 'string_width', 'measure')
+
+
+MAGIC = b'BERICHTM'
+# 2: coverage kept past the last width differing from the default
+VERSION = 2
+# magic, version, kind, width typecode, code points, name length, ascent, descent, default width
+HEADER = struct.Struct('<8sBBcxII3d')
+TRUETYPE, TYPE1 = 0, 1
+# Type1 fonts cover the Basic Multilingual Plane at most, through their encoding
+TYPE1_CODEPOINTS = 0x10000
+# texts measured per font remembered, most recently used, most are words which repeat a lot
+MEASURED_SIZE = 4096
+
+
+def pad(size):
+    return -size % 8
+
+
+def compact(widths):
+    """ `widths` as single precision floats unless that changes any of them. """
+    single = array('f', widths)
+    return single if single == widths else widths
+
+
+def fallbacks(font):
+    """ The fonts text in Type1 `font` is shown in, by priority. """
+    return [font] + font.substitutionFonts
+
+
+def encode(chars, encoding):
+    """
+    Splits `chars` for a single byte `encoding`, yields runs which
+    can be encoded, their bytes and the run following which can't.
+    """
+    while chars:
+        try:
+            yield chars, chars.encode(encoding), ''
+            return
+        except UnicodeEncodeError as error:
+            yield chars[:error.start], chars[:error.start].encode(encoding), chars[error.start:error.end]
+            chars = chars[error.end:]
+
+
+class FontMetrics:
+    """
+    Advance widths of a font per code point in 1/1000 of the font size,
+    code points past the end of `widths` have the `default_width`.
+    `glyphs` maps code points to the glyph of TrueType fonts and to the
+    position in the fallback chain, starting at 1, of Type1 fonts; 0 if
+    no font has a glyph for it.
+    """
+
+    def __init__(self, name, kind, ascent, descent, default_width, widths, glyphs):
+        self.name = name
+        self.kind = kind
+        self.ascent = ascent
+        self.descent = descent
+        self.default_width = default_width
+        self.widths = widths
+        self.glyphs = glyphs
+        self.measured = OrderedDict()  # text -> width in 1/1000 of the font size
+
+    def string_width(self, text, size):
+        """ Width of `text` in points, the same as reportlab's `stringWidth`. """
+        measured = self.measured
+        total = measured.get(text)
+        # tables are shared by threads, entries may be dropped by another one meanwhile
+        try:
+            if total is None:
+                total = measured[text] = self.width(text)
+                if len(measured) > MEASURED_SIZE:
+                    measured.popitem(last=False)
+            else:
+                measured.move_to_end(text)
+        except KeyError:
+            pass
+        # reportlab multiplies in this order, results are identical to the last bit
+        if self.kind == TYPE1:
+            return total*0.001*size
+        return 0.001*size*total
+
+    def width(self, text):
+        widths = self.widths
+        try:
+            return sum(map(widths.__getitem__, map(ord, text)))
+        except IndexError:
+            end, default = len(widths), self.default_width
+            return sum(widths[code] if code < end else default for code in map(ord, text))
+
+    def split(self, text):
+        """
+        Splits `text` of a Type1 font into runs shown by the same font of
+        the fallback chain, yields its position (0 for none) and the run.
+        """
+        glyphs, end = self.glyphs, len(self.glyphs)
+        for position, run in groupby(text, lambda char: glyphs[ord(char)] if ord(char) < end else 0):
+            yield position, ''.join(run)
+
+    @classmethod
+    def from_font(cls, font):
+        """ Metrics of a reportlab font. """
+        if isinstance(font, TTFont):
+            face = font.face
+            widths, glyphs = face.charWidths, face.charToGlyph
+            end = max(chain(
+                (code for code, width in widths.items() if width != face.defaultWidth),
+                (code for code, glyph in glyphs.items() if glyph)
+            ), default=-1) + 1
+            return cls(
+                font.fontName, TRUETYPE, face.ascent, face.descent, face.defaultWidth,
+                compact(array('d', (widths.get(code, face.defaultWidth) for code in range(end)))),
+                array('H', (glyphs.get(code, 0) for code in range(end))),
+            )
+        default_width = font._notdefFont.widths[ord(font._notdefChar)]
+        widths, glyphs = array('d', [default_width]) * TYPE1_CODEPOINTS, array('H', [0]) * TYPE1_CODEPOINTS
+        chars = ''.join(map(chr, range(TYPE1_CODEPOINTS)))
+        # what a font can't encode is left to the next one of the chain, as reportlab does
+        for position, fallback in enumerate(fallbacks(font), 1):
+            rest = []
+            for encodable, encoded, unencodable in encode(chars, fallback.encName):
+                for char, code in zip(encodable, encoded):
+                    widths[ord(char)] = fallback.widths[code]
+                    glyphs[ord(char)] = position
+                rest.append(unencodable)
+            chars = ''.join(rest)
+        while glyphs and not glyphs[-1] and widths[-1] == default_width:
+            glyphs.pop()
+        del widths[len(glyphs):]
+        return cls(font.fontName, TYPE1, font.face.ascent, font.face.descent, default_width, compact(widths), glyphs)
+
+    def dump(self):
+        """ The metrics in the file format read by `load`. """
+        widths = compact(array('d', self.widths))
+        name = self.name.encode()
+        header = HEADER.pack(
+            MAGIC, VERSION, self.kind, widths.typecode.encode(), len(widths), len(name),
+            self.ascent, self.descent, self.default_width
+        )
+        name += bytes(pad(HEADER.size + len(name)))
+        return b''.join((header, name, widths.tobytes(), array('H', self.glyphs).tobytes()))
+
+    def save(self, path):
+        with open(path, 'wb') as metrics:
+            metrics.write(self.dump())
+
+    @classmethod
+    def load(cls, path):
+        """ Maps the metrics file at `path`, tables are read from the mapped pages. """
+        with open(path, 'rb') as metrics:
+            data = mmap.mmap(metrics.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(data)
+        magic, version, kind, typecode, count, name_length, ascent, descent, default_width = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a font metrics file of version {}'.format(path, VERSION))
+        start = HEADER.size + name_length
+        name = bytes(view[HEADER.size:start]).decode()
+        start += pad(start)
+        typecode = typecode.decode()
+        end = start + count * struct.calcsize(typecode)
+        return cls(
+            name, kind, ascent, descent, default_width,
+            view[start:end].cast(typecode), view[end:end + count * 2].cast('H')
+        )
+
+
+# font name -> FontMetrics, loaded from a file or built from the font when first used
+METRICS = {}
+
+
+def register(path):
+    """ Loads the metrics file at `path`, used from now on to measure text in its font. """
+    metrics = FontMetrics.load(path)
+    METRICS[metrics.name] = metrics
+    return metrics
+
+
+def font_metrics(font_name):
+    metrics = METRICS.get(font_name)
+    if metrics is None:
+        metrics = METRICS[font_name] = FontMetrics.from_font(getFont(font_name))
+    return metrics
+
+
+def string_width(text, font_name, font_size):
+    return font_metrics(font_name).string_width(text, font_size)
+
+
+def measure(text, style):
+    """ Width of `text` in the font of `style`. """
+    return font_metrics(style.font_name).string_width(text, style.font_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bericht.html.metrics', description='Precompiles font metrics.')
+    parser.add_argument('fonts', nargs='+', help='name of a registered font or path of a TrueType file')
+    parser.add_argument('-o', '--output', default='.', help='directory to write the metrics files to')
+    args = parser.parse_args(argv)
+    for font in args.fonts:
+        if os.path.isfile(font):
+            font = TTFont(os.path.splitext(os.path.basename(font))[0], font)
+        else:
+            font = getFont(font)
+        path = os.path.join(args.output, font.fontName + '.metrics')
+        FontMetrics.from_font(font).save(path)
+        print(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
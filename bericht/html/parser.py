@@ -29,6 +29,18 @@ def pumper(html_generator):
             break
 
 
+def release(element):
+    """
+    Frees an element that has been turned into a root box
+    along with any siblings that came before it.
+    """
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
 def iter_previous_current_last(child_iter):
     current_child = next(child_iter, None)
     if current_child:
@@ -53,10 +65,20 @@ class GrowingList(list):
 
 
 class HTMLParser:
+    """
+    Turns HTML from `html_generator` into a stream of root boxes.
+
+    Column widths of root tables are measured in a separate pass over
+    the whole document by default. Passing `lookahead` selects single
+    pass parsing instead: each root table is measured from its header,
+    footer and first `lookahead` body rows, which are buffered, and the
+    rest of the table is streamed without being measured.
+    """
 
-    def __init__(self, html_generator, css=None):
+    def __init__(self, html_generator, css=None, lookahead=None):
         self.html_generator = html_generator
         self.css = css
+        self.lookahead = lookahead
         self.table_columns = None
         self.stream = None
 
@@ -150,7 +172,7 @@ class HTMLParser:
                 break
 
     def make_child(self, parent, tag, attrib):
-        node = Box(parent, tag, attrib)
+        node = Box(parent, tag, dict(attrib))
         self.css.apply(node)
         node.behavior = self.get_behavior(parent.behavior if parent else None, node)
         if parent and parent.buffered:
@@ -197,6 +219,23 @@ class HTMLParser:
 
         return Block(node)
 
+    @staticmethod
+    def measure_table(table, rows=()):
+        columns = table.columns.behavior
+        data = {
+            'maximums': GrowingList(),
+            'span': 1
+        }
+        if table.thead:
+            for hrow in table.thead.children:
+                columns.measure(hrow, data)
+        if table.tfoot:
+            for frow in table.tfoot.children:
+                columns.measure(frow, data)
+        for row in rows:
+            columns.measure(row, data)
+        return data
+
     def measure_column_widths(self):
         table_columns = []
         columns = None
@@ -205,28 +244,53 @@ class HTMLParser:
                 table = box.parent.parent.behavior
                 if table.columns.behavior is not columns:
                     columns = table.columns.behavior
-                    table_columns.append({
-                        'maximums': GrowingList(),
-                        'span': 1
-                    })
-                    if table.thead:
-                        for hrow in table.thead.children:
-                            columns.measure(hrow, table_columns[-1])
-                    if table.tfoot:
-                        for frow in table.tfoot.children:
-                            columns.measure(frow, table_columns[-1])
+                    table_columns.append(self.measure_table(table))
                 columns.measure(box, table_columns[-1])
         return table_columns
 
+    def lookahead_boxes(self):
+        boxes = self.boxes()
+        columns = None
+        pending = None
+        while True:
+            box = pending or next(boxes, None)
+            pending = None
+            if box is None:
+                break
+            if isinstance(box.behavior, TableRow):
+                table = box.parent.parent.behavior
+                if table.columns.behavior is not columns:
+                    columns = table.columns.behavior
+                    window = [box]
+                    for box in boxes:
+                        if (len(window) < self.lookahead and
+                                isinstance(box.behavior, TableRow) and
+                                box.parent.parent.behavior is table):
+                            window.append(box)
+                        else:
+                            pending = box
+                            break
+                    data = self.measure_table(table, window)
+                    columns.measurements = data['maximums']
+                    columns.span = data['span']
+                    yield from window
+                    continue
+            yield box
+
     def boxes(self):
         self.stream = pumper(self.html_generator)
         next(self.stream)  # html
         _, body_element = next(self.stream)  # body
         node = self.make_child(None, body_element.tag, body_element.attrib)
         node.buffered = False
-        return map(lambda r: r[1], self.parse(node))
+        for element, box in self.parse(node):
+            yield box
+            release(element)
 
     def __iter__(self):
+        if self.lookahead is not None:
+            yield from self.lookahead_boxes()
+            return
         if self.table_columns is None:
             self.table_columns = self.measure_column_widths()
         yield from self.boxes()
@@ -19,10 +19,12 @@ TABLE_CHILDREN = {
 
 
 class Table(Behavior):
-    __slots__ = ()
+    __slots__ = ('above',)
 
     def __init__(self, box):
         super().__init__(box)
+        # canvas, y and bottom border width per column of the last row drawn
+        self.above = None
         columns = Box(self.box, 'colgroup', {})
         columns.style = columns.style.set(display='table-column-group')
         columns.behavior = TableColumnGroup(columns)
@@ -74,6 +76,8 @@ class Table(Behavior):
 
     def reserve_header_height(self, page, available_width):
         if self.thead and self.thead.behavior.drawn_on != page.page_number:
+            if page.document.header_xobjects:
+                return self.thead.behavior.get_form(page, available_width)[1]
             return self.thead.wrap(page, available_width)
         return 0
 
@@ -93,6 +97,8 @@ class Table(Behavior):
 
     def draw_header(self, page, x, y):
         if self.thead and self.thead.behavior.drawn_on != page.page_number:
+            if page.document.header_xobjects:
+                return self.thead.behavior.draw_form(page, x, y)
             return self.thead.draw(page, x, y)
         return x, y
 
@@ -319,11 +325,13 @@ class TableColumn(Behavior):
 
 
 class TableRowGroup(Behavior):
-    __slots__ = ('drawn_on',)
+    __slots__ = ('drawn_on', 'forms', 'form')
 
     def __init__(self, box):
         super().__init__(box)
         self.drawn_on = None
+        self.forms = {}  # width -> (PDFForm, height)
+        self.form = None
 
     @property
     def text_allowed(self):
@@ -341,12 +349,52 @@ class TableRowGroup(Behavior):
 
     def draw(self, page, x, y):
         self.drawn_on = page.page_number
+        x, y = self.draw_rows(page, x, y)
+        self.box.position += 1
+        return x, y
+
+    def draw_rows(self, canvas, x, y):
         for row in self.box.children:
-            x, y = row.behavior._draw(page, x, y)
+            x, y = row.behavior._draw(canvas, x, y)
+        return x, y
+
+    def get_form(self, page, available_width):
+        """
+        The rows drawn into a form XObject and their height, the form is
+        reused for every placement with the same width. It reaches past
+        the rows by half of the widest border, so strokes on their edges
+        are not clipped.
+        """
+        if available_width not in self.forms:
+            height = self.wrap(page, available_width)
+            pad = max(
+                max(s.border_top_width, s.border_right_width, s.border_bottom_width, s.border_left_width)
+                for s in styles(self.box)
+            ) / 2.0
+            form = page.document.form(available_width + pad*2, height + pad*2)
+            form.baseline = pad
+            self.draw_rows(form, pad, height + pad)
+            page.document.add_form(form)
+            self.forms[available_width] = form, height
+        self.form = self.forms[available_width]
+        return self.form
+
+    def draw_form(self, page, x, y):
+        self.drawn_on = page.page_number
+        form, height = self.form
+        y -= height
+        form.place(page, x - form.baseline, y - form.baseline)
         self.box.position += 1
         return x, y
 
 
+def styles(box):
+    yield box.style
+    for child in box.children:
+        if isinstance(child, Box):
+            yield from styles(child)
+
+
 class TableRow(Behavior):
     __slots__ = ()
 
@@ -457,32 +505,64 @@ class TableRow(Behavior):
 
     def _draw(self, page, x, y):
         original_x, original_y = x, y
+        bottom = original_y - self.box.height
+        table = self.box.parent.parent.behavior
+        above = None
         if self.collapsed:
             x += self.horizontal_spacing / 2.0
+            self.draw_border_and_background(page, original_x, bottom - (self.vertical_spacing / 2.0))
+            if table.above is not None and table.above[0] is page and table.above[1] == original_y:
+                above = table.above[2]
         y -= self.frame_top
         children = self.box.children
         cell_widths = self.box.lines
-        last = len(cell_widths)-1
+        cells, bottoms = [], []
         for i, (cell, width) in enumerate(zip(children, cell_widths)):
+            span = cell.behavior.colspan if cell else 1
             if cell:
-                if False and self.collapsed:
+                cell.behavior.draw_background(page, x, bottom)
+                if self.collapsed:
                     self.draw_collapsed_cell_border(
-                        None if i == 0 else self.box.children[i-1],
-                        cell,
-                        None if i == last else self.box.children[i+1],
+                        page, x, bottom, self.neighbour(i, -1), cell, self.neighbour(i, 1),
+                        above and above[len(bottoms):len(bottoms)+span]
                     )
                 else:
-                    cell.behavior.draw_border_and_background(page, x, original_y - self.box.height)
-                    cell.behavior.draw(page, x, y)
+                    cell.behavior.draw_border(page, x, bottom)
+                cells.append((cell, x))
+            bottoms.extend([cell.style.border_bottom_width if cell else 0] * span)
             x += width
             if self.collapsed:
                 x += self.horizontal_spacing / 2.0
         if self.collapsed:
-            self.draw_border_and_background(page, original_x, original_y - self.box.height - (self.vertical_spacing / 2.0))
-        return original_x, original_y - self.box.height
-
-    def draw_collapsed_cell_border(self, before, cell, after):
-        pass
+            table.above = page, bottom, bottoms
+        # backgrounds and then borders of the whole row go in one batch each,
+        # underneath the text
+        page.borders.paint()
+        for cell, x in cells:
+            cell.behavior.draw(page, x, y)
+        return original_x, bottom
+
+    def neighbour(self, i, step):
+        """ The cell next to the `i`th one, cells left out by a split resolve to the one spanning them. """
+        children = self.box.children
+        i += step
+        while 0 <= i < len(children):
+            if children[i]:
+                return children[i]
+            i += step
+        return None
+
+    def draw_collapsed_cell_border(self, page, x, y, before, cell, after, above=()):
+        # of two adjacent edges only the wider one is drawn, on a tie the left
+        # cell's, and the top edge is left to the row above when its bottom
+        # edges over the cell's columns are at least as wide
+        s = cell.style
+        cell.behavior.draw_border(
+            page, x, y,
+            left=before is None or before.style.border_right_width < s.border_left_width,
+            right=after is None or after.style.border_left_width <= s.border_right_width,
+            top=not above or len(above) < cell.behavior.colspan or min(above) < s.border_top_width,
+        )
 
 
 class TableCell(Behavior):
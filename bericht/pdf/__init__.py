@@ -1,4 +1,6 @@
 from .document import *
 from .letterhead import *
 from .page import *
+from .shard import *
 from .stream import *
+from .font import SubsetCache, subset_cache
@@ -0,0 +1,73 @@
+__all__ = ('PDFBorders',)
+
+
+class PDFBorders:
+    """
+    Collects the backgrounds and border edges of a page so that they can be
+    painted in batches: one fill per color and one stroke per line width and
+    color, with collinear edges merged and shared edges stroked only once.
+    A batch is painted before the text drawn on top of it, anything left
+    when the content is flushed.
+
+    Edges are axis aligned, in page coordinates.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.fills = {}  # color -> [(x, y, width, height)]
+        # (width, color) -> {(horizontal, coordinate): [(start, end)]}
+        self.edges = {}
+
+    def __bool__(self):
+        return bool(self.fills or self.edges)
+
+    def fill(self, color, x, y, width, height):
+        self.fills.setdefault(color, []).append((x, y, width, height))
+
+    def edge(self, color, width, x1, y1, x2, y2):
+        lines = self.edges.setdefault((width, color), {})
+        if y1 == y2:
+            key, start, end = (True, round(y1, 3)), x1, x2
+        else:
+            key, start, end = (False, round(x1, 3)), y1, y2
+        lines.setdefault(key, []).append((min(start, end), max(start, end)))
+
+    def paint_fills(self):
+        page, stream = self.page, self.page.stream
+        for color, rectangles in self.fills.items():
+            page.fill_color(*color)
+            for rectangle in rectangles:
+                stream.op(b're', *rectangle)
+            stream += b"f\n"
+        self.fills = {}
+
+    def paint(self):
+        """ Paints the fills and then strokes the edges collected so far. """
+        self.paint_fills()
+        page, stream = self.page, self.page.stream
+        for (width, color), lines in self.edges.items():
+            page.line_width(width)
+            page.stroke_color(*color)
+            for (horizontal, coordinate), segments in lines.items():
+                for start, end in merge(segments):
+                    if horizontal:
+                        stream.op(b'm', start, coordinate)
+                        stream.op(b'l', end, coordinate)
+                    else:
+                        stream.op(b'm', coordinate, start)
+                        stream.op(b'l', coordinate, end)
+            stream += b"S\n"
+        self.edges = {}
+
+
+def merge(segments, tolerance=0.001):
+    """ Joins overlapping and touching (start, end) intervals. """
+    segments.sort()
+    start, end = segments[0]
+    for next_start, next_end in segments[1:]:
+        if next_start <= end + tolerance:
+            end = max(end, next_end)
+        else:
+            yield start, end
+            start, end = next_start, next_end
+    yield start, end
@@ -0,0 +1,85 @@
+from .borders import PDFBorders
+from .content import ContentStream
+from .optimize import optimize
+from .text import PDFText
+
+__all__ = ('PDFCanvas',)
+
+
+class PDFCanvas:
+    """
+    Content stream being drawn and the resources it uses,
+    the part pages and form XObjects have in common.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.stream = ContentStream()
+        self.borders = PDFBorders(self)
+        # Initialize the Font, XObject, and ExtGState dictionaries
+        self.resources = {
+            'ProcSet': ['PDF', 'Text', 'ImageB', 'ImageC', 'ImageI'],
+        }
+
+    @property
+    def font(self):
+        if 'Font' not in self.resources:
+            self.resources['Font'] = {}
+        return self.resources['Font']
+
+    @property
+    def xobject(self):
+        if 'XObject' not in self.resources:
+            self.resources['XObject'] = {}
+        return self.resources['XObject']
+
+    def write(self, chunk):
+        self.stream += chunk.encode() if isinstance(chunk, str) else chunk
+
+    def flush(self):
+        """ Returns and clears the content drawn so far, pending borders included. """
+        self.borders.paint()
+        content = bytes(self.stream)
+        del self.stream[:]
+        if content and self.document.optimize:
+            content = optimize(content)
+        return content
+
+    def save_state(self):
+        self.stream += b"q\n"
+
+    def restore_state(self):
+        self.stream += b"Q\n"
+
+    def translate(self, x, y):
+        self.stream.op(b'cm', 1, 0, 0, 1, x, y)
+
+    def begin_text(self, x, y):
+        return PDFText(self, x, y)
+
+    def line_width(self, width):
+        self.stream.op(b'w', width)
+
+    def stroke_color(self, r, g, b, a):
+        assert a == 1, "TODO: implement alpha"
+        self.stream.op(b'RG', r, g, b)
+
+    def line(self, x1, y1, x2, y2):
+        self.stream.op(b'm', x1, y1)
+        self.stream.op(b'l S', x2, y2)
+
+    def fill_color(self, r, g, b, a):
+        assert a == 1, "TODO: implement alpha"
+        self.stream.op(b'rg', r, g, b)
+
+    def rectangle(self, x, y, width, height):
+        self.stream.op(b're f*', x, y, width, height)
+
+    def draw_xobject(self, name, x=0, y=0):
+        if x or y:
+            self.save_state()
+            self.translate(x, y)
+            self.stream += '/{} Do\n'.format(name).encode()
+            self.restore_state()
+        else:
+            self.stream += '/{} Do\n'.format(name).encode()
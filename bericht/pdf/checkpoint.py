@@ -0,0 +1,127 @@
+import json
+import zlib
+from array import array
+from pdfrw.objects import PdfObject
+from reportlab.pdfbase.ttfonts import TTFont
+from .font import getFont
+from .form import PDFForm
+from .letterhead import PDFLetterhead
+from .reference import PDFReference
+
+__all__ = ('dump', 'load')
+
+
+# state is a line of JSON followed by the raw object offsets, zlib compressed
+
+
+def dump(document, cursor=None):
+    """
+    Serializes the state of `document` between two pages, everything
+    written so far has to be finalized: no pending or packed objects.
+    """
+    assert not document.pending and not document.pages.finished and not document.packed
+    state = {
+        'offset': document.offset,
+        'ref_ids': document.ref_ids,
+        'root': document.root.id,
+        'info': [document.info.id, document.info.meta],
+        'pages': [document.page_count, document.pages.count, [
+            None if node is None else [node.id, list(map(str, node.meta['Kids'])), node.meta['Count']]
+            for node in document.pages.spine
+        ]],
+        'resources': [[key.decode('latin-1'), str(ref)] for key, ref in document.resources.items()],
+        'font_references': {name: ref.id for name, ref in document.font_references.items()},
+        'fontMapping': document.fontMapping,
+        'delayedFonts': [font.fontName for font in document.delayedFonts],
+        'subsets': {
+            font.fontName: dump_subsets(font.state[document])
+            for font in document.delayedFonts if isinstance(font, TTFont)
+        },
+        'letterhead': [
+            [page.name, page.id] for page in document.letterhead.pages
+        ] if document.letterhead else None,
+        'forms': document.forms,
+        'text_forms': [
+            [list(key), form.name, form.ref.id, width, form.width, form.height, form.baseline]
+            for key, (form, width) in document.text_forms.items()
+        ],
+        'total_pages_forms': [
+            [list(key), form.name, form.ref.id, form.height, form.baseline]
+            for key, form in document.total_pages_forms.items()
+        ],
+        'cursor': cursor,
+    }
+    header = json.dumps(state, separators=(',', ':')).encode()
+    return zlib.compress(header + b'\n' + document.offsets.tobytes())
+
+
+def dump_subsets(state):
+    return {
+        'assignments': [item for pair in state.assignments.items() for item in pair],
+        'nextCode': state.nextCode,
+        'internalName': state.internalName,
+        'frozen': state.frozen,
+        'subsets': state.subsets,
+    }
+
+
+def load(document, data):
+    """
+    Restores the state saved by `dump` into a new `document`,
+    returns the cursor which was saved along with it.
+    """
+    header, offsets = zlib.decompress(data).split(b'\n', 1)
+    state = json.loads(header.decode())
+    document.offset = state['offset']
+    document.ref_ids = state['ref_ids']
+    document.offsets = array('Q')
+    document.offsets.frombytes(offsets)
+    document.root = PDFReference(state['root'], {'Type': 'Catalog'})
+    document.info = PDFReference(*state['info'])
+
+    tree = document.pages
+    document.page_count, tree.count, spine = state['pages']
+    tree.spine = [
+        None if node is None else PDFReference(node[0], {
+            'Type': 'Pages', 'Kids': list(map(PdfObject, node[1])), 'Count': node[2]
+        })
+        for node in spine
+    ]
+
+    document.resources.clear()
+    for key, ref in state['resources']:
+        document.resources[key.encode('latin-1')] = PdfObject(ref)
+
+    document.font_references = {name: PDFReference(id) for name, id in state['font_references'].items()}
+    document.fontMapping = state['fontMapping']
+    document.delayedFonts = list(map(getFont, state['delayedFonts']))
+    for name, subsets in state['subsets'].items():
+        font = getFont(name)
+        font.state[document] = load_subsets(font, subsets)
+
+    if state['letterhead']:
+        document.letterhead = PDFLetterhead.restore(document, [
+            PDFReference(id, name=name) for name, id in state['letterhead']
+        ])
+
+    document.forms = state['forms']
+    for key, name, id, width, form_width, height, baseline in state['text_forms']:
+        form = PDFForm(document, name, form_width, height, id)
+        form.baseline = baseline
+        document.text_forms[tuple(key)] = form, width
+    for key, name, id, height, baseline in state['total_pages_forms']:
+        form = PDFForm(document, name, 0, height, id)
+        form.baseline = baseline
+        document.total_pages_forms[tuple(key)] = form
+    return state['cursor']
+
+
+def load_subsets(font, data):
+    state = TTFont.State(font._asciiReadable, font)
+    assignments = data['assignments']
+    state.assignments = dict(zip(assignments[::2], assignments[1::2]))
+    state.nextCode = data['nextCode']
+    state.internalName = data['internalName']
+    state.frozen = data['frozen']
+    state.subsets = data['subsets']
+    return state
@@ -0,0 +1,37 @@
+__all__ = ('number', 'ContentStream')
+
+
+def number(value):
+    """
+    Formats `value` as a PDF number: integers as they are,
+    reals rounded to three decimals without trailing zeros.
+    """
+    if type(value) is int:
+        return b'%d' % value
+    formatted = (b'%.3f' % value).rstrip(b'0').rstrip(b'.')
+    return formatted if formatted != b'-0' else b'0'
+
+
+class ContentStream(bytearray):
+    """
+    Page content built in place, one operator at a time.
+    """
+
+    def op(self, operator, *operands):
+        """ Appends `operator` (bytes) preceded by its numeric `operands`. """
+        self += b' '.join(map(number, operands))
+        self.append(32)
+        self += operator
+        self.append(10)
+
+    def named(self, operator, name, *operands):
+        """ Appends `operator` with a `name` (like /F1) as its first operand. """
+        self += name.encode()
+        self.append(32)
+        self.op(operator, *operands)
+
+    def show(self, escaped):
+        """ Appends a Tj showing `escaped`, an already escaped PDF string. """
+        self.append(40)
+        self += escaped.encode() if isinstance(escaped, str) else escaped
+        self += b') Tj\n'
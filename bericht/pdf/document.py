@@ -1,40 +1,96 @@
-from .reference import PDFReference
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from reportlab.lib.rl_accel import escapePDF
+from .reference import PDFReference, serialize, indirect
 from .letterhead import PDFLetterhead
-from .page import PDFPage
-from .font import read_font
+from bericht.html.metrics import measure, string_width, font_metrics, fallbacks
+from .form import PDFForm
+from .page import PDFPage, PDFDryPage
+from .tree import PDFPageTree
+from .update import PDFUpdate
+from . import checkpoint
+from .font import SUBSETN, getFont, read_font, subset_cache as default_subset_cache
 
 __all__ = ('PDFDocument',)
 
 
+OBJECT_STREAM_SIZE = 100
+RESOURCES_CACHE_SIZE = 32
+TEXT_CACHE_SIZE = 1024
+# digits reserved for page numbers drawn once they are known, more
+# when the number of the current page has more already
+NUMBER_DIGITS = 4
+XREF_LINES_PER_CHUNK = 1024
+
+# offsets of objects packed into an object stream are stored
+# as PACKED | object stream id << 16 | index within the stream
+PACKED = 1 << 63
+
+
 class PDFDocument:
 
-    def __init__(self, css, letterhead=None, layout='portrait'):
+    def __init__(self, css, letterhead=None, layout='portrait', compress=None, object_streams=False,
+                 optimize=False, header_xobjects=False, update=None, page_range=None,
+                 subset_cache=None):
         self.css = css
+        self.compress = compress  # zlib level, None disables compression
+        self.optimize = optimize  # peephole optimize page content
+        # draw repeated table headers once into a form XObject
+        self.header_xobjects = header_xobjects
+        self.forms = 0
+        # (text, font name, font size, leading) -> (form, text width)
+        self.text_forms = {}
+        # (font name, font size, leading) -> form, drawn in the footer
+        self.total_pages_forms = {}
+        # PDF 1.5 object streams and cross-reference stream
+        self.object_streams = object_streams
+        self.packed = []
         self.ref_ids = 0
         self.offset = 0
-        self.references = []
+        # object id -> byte offset, only the objects which still
+        # have to be written are kept alive until the footer
+        self.offsets = array('Q', [0])
         self.page = None
         self.layout = layout
+        # serialized resources dictionary -> reference, most recently used last
+        self.resources = OrderedDict()
+        self.pages = PDFPageTree(self)
+        # pages laid out, the ones outside of `page_range` included
+        self.page_count = 0
+        # page numbers to write, all when None
+        if page_range is not None and not page_range:
+            raise ValueError('page_range is empty')
+        self.page_range = page_range
+        self.last_page = max(page_range) if page_range is not None else None
+        self.pending = []  # complete objects, written after the current page
         self.root = self.ref({
             'Type': 'Catalog',
-            'Pages': self.ref({
-                'Type': 'Pages',
-                'Count': 0,
-                'Kids': []
-            })
         })
         self.info = self.ref({
             'Producer': '(bericht)',
         })
-        self.letterhead = PDFLetterhead(self, letterhead) if letterhead else None
+        self.letterhead = PDFLetterhead(self, letterhead) if letterhead and not update else None
 
         # font id (/F1) -> Reference object (7 0 R)
         self.font_references = {}
         # required by reportlab fonts handling code:
         self.fontMapping = {}  # font name (Helvetica) -> font id (/F1)
         self.delayedFonts = []  # fonts to be rendered
+        # (font name, text) -> text runs, most recently drawn last
+        self.texts = OrderedDict()
+        # TrueType subsets ready to embed, shared by the documents of the process
+        self.subset_cache = default_subset_cache if subset_cache is None else subset_cache
+        # TrueType font name -> number of its first subset tag, past the ones of an updated file
+        self.subset_numbers = {}
+
+        # path of an existing PDF to append the pages to
+        self.update = PDFUpdate(self, update) if update else None
 
     def header(self):
+        if self.update:
+            return
         src = b"%PDF-1.7\n%\xc3\xbf\xc3\xbf\xc3\xbf\xc3\xbf\n"
         self.offset += len(src)
         yield src
@@ -42,36 +98,135 @@ class PDFDocument:
             yield from self.letterhead.read()
 
     def finalize_reference(self, ref):
-        ref.offset = self.offset
+        if self.object_streams and not ref.chunks:
+            yield from self.pack_reference(ref)
+            return
+        if self.compress is not None:
+            ref.compress(self.compress)
+        self.offsets[ref.id] = self.offset
         for chunk in ref.read():
             self.offset += len(chunk)
             yield chunk
 
+    @property
+    def stream_compression(self):
+        return zlib.Z_DEFAULT_COMPRESSION if self.compress is None else self.compress
+
+    def pack_reference(self, ref):
+        self.packed.append((ref.id, ref.serialize_meta()))
+        if len(self.packed) >= OBJECT_STREAM_SIZE:
+            yield from self.read_object_stream()
+
+    def read_object_stream(self):
+        if not self.packed:
+            return
+        stream = self.ref({'Type': 'ObjStm', 'N': len(self.packed)})
+        offsets = []
+        position = 0
+        for index, (ref_id, obj) in enumerate(self.packed):
+            self.offsets[ref_id] = PACKED | stream.id << 16 | index
+            offsets.append('{} {}'.format(ref_id, position))
+            position += len(obj)
+        header = ' '.join(offsets).encode() + b'\n'
+        stream.meta['First'] = len(header)
+        stream.write(header)
+        for _, obj in self.packed:
+            stream.write(obj)
+        self.packed = []
+        stream.compress(self.stream_compression)
+        yield from self.finalize_reference(stream)
+
+    def read_xref_stream(self):
+        xref = self.ref({'Type': 'XRef'})
+        startxref = self.offsets[xref.id] = self.offset
+        xref.update(self.trailer())
+        sections = self.xref_sections()
+        if self.update:
+            xref.meta['Index'] = [n for start, end in sections for n in (start, end - start)]
+        width = (max(self.offset, self.ref_ids).bit_length() + 7) // 8
+        xref.meta['W'] = [1, width, 2]
+        entries = []
+        for start, end in sections:
+            if start == 0:
+                entries.append(b'\x00' + bytes(width) + b'\xff\xff')
+                start = 1
+            entries.extend(self.xref_stream_entries(start, end, width))
+        xref.write(b''.join(entries))
+        xref.compress(self.stream_compression)
+        yield from self.finalize_reference(xref)
+        yield b"startxref\n"
+        yield str(startxref).encode()
+        yield b"\n%%EOF\n"
+
+    def xref_stream_entries(self, start, end, width):
+        for offset in islice(self.offsets, start, end):
+            if offset & PACKED:
+                yield (
+                    b'\x02' + (offset >> 16 & 0xffffffff).to_bytes(width, 'big') +
+                    (offset & 0xffff).to_bytes(2, 'big')
+                )
+            else:
+                yield b'\x01' + offset.to_bytes(width, 'big') + b'\x00\x00'
+
+    def xref_sections(self):
+        """ (start, end) object id ranges of the cross-reference section. """
+        if self.update:
+            return self.update.sections(len(self.offsets))
+        return [(0, len(self.offsets))]
+
+    def trailer(self):
+        trailer = {
+            'Size': len(self.offsets),
+            'Root': self.root,
+            'Info': self.info,
+        }
+        if self.update:
+            trailer['Prev'] = self.update.prev
+        return trailer
+
     @property
     def footer_refs(self):
+        if self.update:
+            yield self.update.pages
+            return
         yield self.info
         yield self.root
-        yield self.root.meta['Pages']
 
     def footer(self):
+        self.draw_total_pages()
+        pages = self.pages.close()
+        if self.update:
+            self.update.attach(pages)
+        else:
+            self.root.meta['Pages'] = pages
         for ref in self.footer_refs:
             yield from self.finalize_reference(ref)
+        yield from self.read_pending()
 
         for font in self.delayedFonts:
             yield from read_font(self, font)
 
+        if self.object_streams:
+            yield from self.read_object_stream()
+            yield from self.read_xref_stream()
+            return
+
         yield b"xref\n"
-        yield "0 {}\n".format(len(self.references) + 1).encode()
-        yield b"0000000000 65535 f \n"
-        for ref in self.references:
-            yield "{:0>10} 00000 n \n".format(ref.offset).encode()
+        lines = []
+        for start, end in self.xref_sections():
+            lines.append("{} {}\n".format(start, end - start))
+            if start == 0:
+                lines.append("0000000000 65535 f \n")
+                start = 1
+            for offset in islice(self.offsets, start, end):
+                lines.append("{:0>10} 00000 n \n".format(offset))
+                if len(lines) >= XREF_LINES_PER_CHUNK:
+                    yield ''.join(lines).encode()
+                    lines = []
+        yield ''.join(lines).encode()
 
         yield b"trailer\n"
-        yield from self.ref({
-            'Size': len(self.references) + 1,
-            'Root': self.root,
-            'Info': self.info
-        }).read_meta()
+        yield serialize(self.trailer()) + b"\n"
 
         yield b"startxref\n"
         yield str(self.offset).encode()
@@ -79,13 +234,191 @@ class PDFDocument:
 
     def ref(self, meta=None, name=None):
         self.ref_ids += 1
-        ref = PDFReference(self.ref_ids, meta, name)
-        self.references.append(ref)
-        return ref
+        self.offsets.append(0)
+        return PDFReference(self.ref_ids, meta, name)
+
+    def checkpoint(self, cursor=None):
+        """
+        Returns the state needed to resume writing after the last page,
+        `cursor` is kept along with it to tell where the source left off.
+        """
+        return checkpoint.dump(self, cursor)
+
+    def restore(self, state):
+        """
+        Picks up from the `state` returned by `checkpoint`, the output
+        continues at the offset it was taken at. Returns the cursor.
+        """
+        return checkpoint.load(self, state)
 
     def add_page(self):
-        pages = self.root.meta['Pages'].meta
-        pages['Count'] += 1
-        self.page = PDFPage(self, pages['Count'], self.css, 'a4', self.layout)
-        pages['Kids'].append(self.page.dictionary)
+        self.page_count += 1
+        if self.page_range is not None and self.page_count not in self.page_range:
+            self.page = PDFDryPage(self, self.page_count, self.css, 'a4', self.layout)
+            return self.page
+        self.page = PDFPage(self, self.page_count, self.css, 'a4', self.layout)
+        self.page.dictionary.meta['Parent'] = indirect(self.pages.add(self.page.dictionary))
         return self.page
+
+    @property
+    def range_complete(self):
+        """ Whether the pages in `page_range` are done and the rest can be skipped. """
+        return (
+            self.page_range is not None and self.page_count >= self.last_page and
+            not self.total_pages_forms
+        )
+
+    def resources_reference(self, resources):
+        """
+        Returns a reference for the page `resources` dictionary and whether it
+        is new and still has to be written; identical dictionaries share one.
+        """
+        resources = {
+            key: dict(sorted(value.items())) if isinstance(value, dict) else value
+            for key, value in sorted(resources.items())
+        }
+        key = serialize(resources)
+        ref = self.resources.get(key)
+        if ref is not None:
+            self.resources.move_to_end(key)
+            return ref, False
+        ref = self.ref(resources)
+        self.resources[key] = indirect(ref)
+        if len(self.resources) > RESOURCES_CACHE_SIZE:
+            self.resources.popitem(last=False)
+        return ref, True
+
+    def font_reference(self, font):
+        """ Resource name (/F1) and reference of `font`, which is written in the footer. """
+        name = self.fontMapping.get(font.fontName)
+        if name is None:
+            name = self.fontMapping[font.fontName] = '/F{}'.format(len(self.fontMapping)+1)
+            self.delayedFonts.append(font)
+        if name not in self.font_references:
+            self.font_references[name] = self.ref()
+        return name, self.font_references[name]
+
+    def subset_tag(self, font, n, subset):
+        """ Tag of the `n`th subset of TrueType `font`, `subset` are its glyphs. """
+        return SUBSETN(self.subset_numbers.get(font.face.name + font.face.subfontNameX, 0) + n)
+
+    def encode_text(self, font_name, text):
+        """
+        Returns whether font `font_name` is a TrueType font and the runs
+        `text` is shown in: (font resource name, reference, escaped string).
+        TrueType text is split into subsets, Type1 text into the fonts of the
+        fallback chain by the coverage map of the font's metrics, the same
+        the text is measured with. Texts drawn repeatedly are encoded once.
+        """
+        key = font_name, text
+        encoded = self.texts.get(key)
+        if encoded is not None:
+            self.texts.move_to_end(key)
+            return encoded
+        font = getFont(font_name)
+        if font._dynamicFont:
+            runs = []
+            for subset, part in font.splitString(text, self):
+                name = font.getSubsetInternalName(subset, self)
+                if name not in self.font_references:
+                    self.font_references[name] = self.ref()
+                runs.append((name, self.font_references[name], escapePDF(part).encode()))
+        elif font._multiByte:
+            runs = [self.font_reference(font) + (font.formatForPdf(text),)]
+        else:
+            runs = [
+                self.font_reference(fallback) + (escapePDF(encoded).encode(),)
+                for fallback, encoded in self.encode_type1(font, text) if encoded
+            ]
+        encoded = self.texts[key] = font._dynamicFont, runs
+        if len(self.texts) > TEXT_CACHE_SIZE:
+            self.texts.popitem(last=False)
+        return encoded
+
+    @staticmethod
+    def encode_type1(font, text):
+        """ Yields the fonts of the fallback chain of `font` showing `text` and their part of it. """
+        try:
+            yield font, text.encode(font.encName)
+            return
+        except UnicodeEncodeError:
+            pass
+        chain = fallbacks(font)
+        for position, run in font_metrics(font.fontName).split(text):
+            if position:
+                fallback = chain[position-1]
+                yield fallback, run.encode(fallback.encName)
+            else:
+                yield chain[-1]._notdefFont, chain[-1]._notdefChar * len(run)
+
+    def form(self, width, height):
+        self.forms += 1
+        return PDFForm(self, 'Form{}'.format(self.forms), width, height)
+
+    def text_form(self, text, style):
+        """ Form showing `text` in the font of `style`, drawn once per document. """
+        key = text, style.font_name, style.font_size, style.leading
+        return self.text_forms.get(key) or self.draw_text_form(key)
+
+    def draw_text_form(self, key):
+        """ Draws the form of `text_form` for `key`, returns it and the text width. """
+        text, font_name, font_size, leading = key
+        width = string_width(text, font_name, font_size)
+        # leave room for glyphs reaching beyond their advance width and baseline
+        form = self.form(width + font_size, leading * 2)
+        form.baseline = leading
+        txt = form.begin_text(0, form.baseline)
+        txt.set_font(font_name, font_size, leading)
+        txt.draw(text)
+        txt.close()
+        self.add_form(form)
+        self.text_forms[key] = form, width
+        return form, width
+
+    def counter_run(self, page, counter, style):
+        """ Text of a margin content `counter` on `page` and its width. """
+        text = str(counter(page))
+        return text, measure(text, style)
+
+    def number_width(self, page, style):
+        """
+        Width reserved on `page` for a page number which is not known yet,
+        enough for `NUMBER_DIGITS` of the widest digit.
+        """
+        digits = max(NUMBER_DIGITS, len(str(page.page_number)))
+        return digits * max(measure(digit, style) for digit in '0123456789')
+
+    def total_pages_form(self, style):
+        """ Form showing the total number of pages, drawn once it is known. """
+        key = style.font_name, style.font_size, style.leading
+        if key not in self.total_pages_forms:
+            form = self.total_pages_forms[key] = self.form(0, style.leading * 2)
+            form.baseline = style.leading
+        return self.total_pages_forms[key]
+
+    def draw_total_pages(self):
+        for key, form in self.total_pages_forms.items():
+            self.draw_number(form, key, self.page_count)
+        self.total_pages_forms = {}
+
+    def draw_number(self, form, key, number):
+        """ Draws `number` into a form left empty until it was known. """
+        font_name, font_size, leading = key
+        text = str(number)
+        form.width = string_width(text, font_name, font_size) + font_size
+        form.ref.meta['BBox'] = [0, 0, form.width, form.height]
+        txt = form.begin_text(0, form.baseline)
+        txt.set_font(font_name, font_size, leading)
+        txt.draw(text)
+        txt.close()
+        self.add_form(form)
+
+    def add_form(self, form):
+        self.pending.append(form.finish())
+
+    def read_pending(self):
+        """ Writes the complete forms and page tree nodes. """
+        finished, self.pending = self.pending + self.pages.finished, []
+        self.pages.finished = []
+        for ref in finished:
+            yield from self.finalize_reference(ref)
@@ -1,7 +1,15 @@
+import os
+import zlib
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
 from reportlab.pdfbase.pdfmetrics import getFont, Font
 from reportlab.pdfbase.ttfonts import TTFont, makeToUnicodeCMap
 
-__all__ = ('getFont', 'read_font')
+__all__ = ('getFont', 'read_font', 'SubsetCache', 'subset_cache')
 
 
 def read_font(doc, font):
@@ -34,15 +42,143 @@ def SUBSETN(n, table=bytes.maketrans(b'0123456789', b'ABCDEFGIJK')):
     return bytes('%6.6d' % n, 'ASCII').translate(table)
 
 
+def subset_number(tag, table=str.maketrans('ABCDEFGIJK', '0123456789')):
+    """ The `n` of a tag made by `SUBSETN`, None for other tags. """
+    number = tag.translate(table)
+    return int(number) if len(tag) == 6 and number.isdigit() else None
+
+
+SUBSET_CACHE_SIZE = 64
+SUBSET_HEADER = struct.Struct('>III')
+
+
+class SubsetCache:
+    """
+    Process wide LRU of TrueType subsets ready to embed: the font program,
+    compressed at the document's level, and the ToUnicode CMap. Entries are
+    keyed by a digest of the font file and the glyphs of the subset. With a
+    `directory` they are also stored there, shared between processes and
+    kept across restarts.
+    """
+
+    def __init__(self, size=SUBSET_CACHE_SIZE, directory=None):
+        self.size = size
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.digests = WeakKeyDictionary()  # font face -> digest of the font file
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, font, name, subset, level=None):
+        """
+        Returns the font program of `subset`, its uncompressed length
+        and the CMap for font `name`; compressed at `level` unless None.
+        """
+        key = self.key(font.face, name, subset, level)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self.load(key)
+        loaded = entry is not None
+        if not loaded:
+            program = font.face.makeSubset(subset)
+            length = len(program)
+            if level is not None:
+                program = zlib.compress(program, level)
+            entry = program, length, makeToUnicodeCMap(name, subset).encode()
+            self.store(key, entry)
+        with self.lock:
+            if loaded:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            self.entries[key] = entry
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def key(self, face, name, subset, level):
+        digest = self.digests.get(face)
+        if digest is None:
+            digest = self.digests[face] = hashlib.sha1(face._ttf_data).digest()
+        key = hashlib.sha1(digest)
+        key.update(repr((name, subset, level)).encode())
+        return key.hexdigest()
+
+    def load(self, key):
+        if self.directory is None:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, 'rb') as cached:
+                data = cached.read()
+        except OSError:
+            # missing or unreadable, the subset is made
+            return None
+        try:
+            length, program_length, cmap_length = SUBSET_HEADER.unpack_from(data)
+        except struct.error:
+            program_length = cmap_length = None
+        start = SUBSET_HEADER.size
+        if program_length is None or len(data) != start + program_length + cmap_length:
+            # truncated or corrupt, the subset is made again
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        return (
+            data[start:start+program_length], length,
+            data[start+program_length:]
+        )
+
+    def store(self, key, entry):
+        if self.directory is None:
+            return
+        program, length, cmap = entry
+        path = None
+        try:
+            # written to a temporary file first, other processes never see half an entry
+            fd, path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as cached:
+                cached.write(SUBSET_HEADER.pack(length, len(program), len(cmap)) + program + cmap)
+            os.replace(path, os.path.join(self.directory, key))
+        except OSError:
+            # a full or unwritable directory only means the entry isn't kept there
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+subset_cache = SubsetCache()
+
+
 def read_truetype(doc, font):
     state = font.state[doc]
     for n, subset in enumerate(state.subsets):
         internalName = font.getSubsetInternalName(n, doc)[1:]
-        baseFontName = (b''.join((SUBSETN(n), b'+', font.face.name, font.face.subfontNameX))).decode('pdfdoc')
+        baseFontName = (b''.join((
+            doc.subset_tag(font, n, subset), b'+', font.face.name, font.face.subfontNameX
+        ))).decode('pdfdoc')
+        program, length, cmap = doc.subset_cache.get(font, baseFontName, subset, doc.compress)
 
         fontFile = doc.ref()
-        fontFile.write(font.face.makeSubset(subset))
-        fontFile.meta['Length1'] = fontFile.meta['Length']
+        fontFile.write(program)
+        fontFile.meta['Length1'] = length
+        if doc.compress is not None:
+            fontFile.meta['Filter'] = 'FlateDecode'
         yield from doc.finalize_reference(fontFile)
 
         flags = font.face.flags & ~ FF_NONSYMBOLIC
@@ -63,7 +199,7 @@ def read_truetype(doc, font):
         yield from doc.finalize_reference(FontDescriptor)
 
         cmapStream = doc.ref()
-        cmapStream.write(makeToUnicodeCMap(baseFontName, subset).encode())
+        cmapStream.write(cmap)
         yield from doc.finalize_reference(cmapStream)
 
         font_ref = doc.font_references['/'+internalName]
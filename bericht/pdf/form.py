@@ -0,0 +1,37 @@
+from .canvas import PDFCanvas
+from .reference import PDFReference, indirect
+
+__all__ = ('PDFForm',)
+
+
+class PDFForm(PDFCanvas):
+    """
+    Form XObject which is drawn once and then placed on any number of pages.
+    Coordinates within the form start at its bottom left corner.
+    """
+
+    def __init__(self, document, name, width, height, id=None):
+        super().__init__(document)
+        self.name = name
+        self.width = width
+        self.height = height
+        self.baseline = 0
+        meta = {
+            'Type': 'XObject',
+            'Subtype': 'Form',
+            'BBox': [0, 0, width, height],
+        }
+        # an `id` is given for forms restored from a checkpoint
+        self.ref = document.ref(meta) if id is None else PDFReference(id, meta)
+
+    def finish(self):
+        """ Completes the form, returns the reference to write. """
+        self.ref.meta['Resources'] = self.resources
+        self.ref.write(self.flush())
+        self.stream = self.borders = self.resources = None
+        return self.ref
+
+    def place(self, canvas, x, y):
+        """ Draws the form on `canvas` with its bottom left corner at `x`, `y`. """
+        canvas.xobject[self.name] = indirect(self.ref)
+        canvas.draw_xobject(self.name, x, y)
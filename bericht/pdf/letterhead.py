@@ -121,6 +121,15 @@ class PDFLetterhead:
             self.pages.append(xobject.form)
             letterhead_num += 1
 
+    @classmethod
+    def restore(cls, document, pages):
+        """ Letterhead whose `pages` were written by an earlier run. """
+        letterhead = cls.__new__(cls)
+        letterhead.document = document
+        letterhead.pages = pages
+        letterhead.refs = []
+        return letterhead
+
     def ref(self, *args, **kwargs):
         ref = self.document.ref(*args, **kwargs)
         self.refs.append(ref)
@@ -129,6 +138,7 @@ class PDFLetterhead:
     def read(self):
         for obj in self.refs:
             yield from self.document.finalize_reference(obj)
+        self.refs = []
 
     def __getitem__(self, item):
         if item < 1:
@@ -0,0 +1,126 @@
+import re
+
+__all__ = ('optimize',)
+
+
+TOKEN = re.compile(rb"""
+    \((?:\\.|[^\\)])*\)       # literal string, parentheses are always escaped
+  | <[0-9A-Fa-f\s]*>          # hex string
+  | /[^\s/\[\]()<>]+          # name
+  | \[ | \]
+  | [^\s/\[\]()<>]+           # number or operator
+""", re.VERBOSE | re.DOTALL)
+
+OPERAND_START = frozenset(b'0123456789+-.(/<[')
+
+# state operators, operators sharing a key overwrite each other
+STATE = {
+    b'w': b'w', b'J': b'J', b'j': b'j', b'M': b'M', b'd': b'd', b'ri': b'ri', b'i': b'i',
+    b'G': b'stroke', b'RG': b'stroke', b'K': b'stroke',
+    b'g': b'fill', b'rg': b'fill', b'k': b'fill',
+    b'Tc': b'Tc', b'Tw': b'Tw', b'Tz': b'Tz', b'TL': b'TL', b'Tf': b'Tf', b'Tr': b'Tr', b'Ts': b'Ts',
+}
+
+# operators starting a new line, setting the text matrix to the line matrix
+NEW_LINE = frozenset((b'BT', b'Td', b'TD', b'Tm', b'T*'))
+
+PAINTING = frozenset((
+    b'S', b's', b'f', b'F', b'f*', b'B', b'B*', b'b', b'b*',
+    b'sh', b'Do', b'BI', b'Tj', b'TJ', b"'", b'"',
+))
+
+
+def instructions(content):
+    """ Yields (operator, operands) pairs of a content stream. """
+    operands = []
+    array = None
+    for token in TOKEN.findall(content):
+        if token == b'[':
+            array = []
+        elif token == b']':
+            operands.append(b'[' + b' '.join(array) + b']')
+            array = None
+        elif array is not None:
+            array.append(token)
+        elif token[0] in OPERAND_START or token in (b'true', b'false', b'null'):
+            operands.append(token)
+        else:
+            yield token, operands
+            operands = []
+
+
+class Group:
+    """ A q/Q or BT/ET block which is dropped if nothing is painted in it. """
+
+    __slots__ = ('operator', 'start', 'state', 'painted')
+
+    def __init__(self, operator, start, state):
+        self.operator = operator
+        self.start = start
+        self.state = state
+        self.painted = False
+
+
+def optimize(content):
+    """
+    Rewrites `content` without redundant state operators, `0 0 Td`
+    moves at the start of a line and q/Q or BT/ET blocks that paint
+    nothing, showing adjacent Tj strings with a single TJ.
+    """
+    output = []
+    state = {}
+    groups = []
+    strings = []
+    # text shown since the start of the line, `0 0 Td` moves back to it
+    shown = False
+
+    def flush_strings():
+        if len(strings) == 1:
+            output.append(strings[0] + b' Tj')
+        elif strings:
+            output.append(b'[' + b''.join(strings) + b'] TJ')
+        del strings[:]
+
+    for operator, operands in instructions(content):
+        if operator == b'Tj' and len(operands) == 1:
+            strings.append(operands[0])
+            shown = True
+            if groups:
+                groups[-1].painted = True
+            continue
+        flush_strings()
+        key = STATE.get(operator)
+        if key is not None:
+            value = (operator, tuple(operands))
+            if state.get(key) == value:
+                continue
+            state[key] = value
+        elif operator in (b'q', b'BT'):
+            groups.append(Group(operator, len(output), state))
+            state = dict(state)
+        elif operator in (b'Q', b'ET'):
+            if groups and groups[-1].operator == (b'q' if operator == b'Q' else b'BT'):
+                group = groups.pop()
+                if operator == b'Q' or not group.painted:
+                    # text state set in a text block outlives ET,
+                    # unless the whole block is dropped
+                    state = group.state
+                if not group.painted:
+                    del output[group.start:]
+                    continue
+                if groups:
+                    groups[-1].painted = True
+            elif operator == b'Q':
+                state = {}
+        elif operator == b'Td' and operands == [b'0', b'0'] and not shown:
+            continue
+        elif operator in PAINTING and groups:
+            groups[-1].painted = True
+        if operator in NEW_LINE:
+            shown = False
+        elif operator in (b'TJ', b"'", b'"'):
+            shown = True
+        operands.append(operator)
+        output.append(b' '.join(operands))
+    flush_strings()
+    return b'\n'.join(output) + b'\n' if output else b''
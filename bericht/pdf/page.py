@@ -1,13 +1,13 @@
-from bericht.html.box import stringWidth
 from bericht.html.style import default as default_style
-from .text import PDFText
+from .canvas import PDFCanvas
 
-__all__ = ('PDFPage',)
+__all__ = ('PDFPage', 'PDFDryPage')
 
 
-class PDFPage:
+class PDFPage(PDFCanvas):
 
     tag = '@page'
+    dry = False
 
     def __init__(self, document, page_number, css, size='letter', layout='portrait'):
         self.parent = None
@@ -16,57 +16,77 @@ class PDFPage:
         self.style = default_style.set(**{
             'margin_'+side: value for side, value in DEFAULT_MARGINS.items()
         })
-        css.apply(self)
+        css.apply_page(self)
         self.margins = {
             side: getattr(self.style, 'margin_'+side) for side in DEFAULT_MARGINS
         }
 
-        self.document = document
+        super().__init__(document)
         self.size = size
         self.layout = layout
 
         dimensions = SIZES[self.size.upper()]
-        self.width = dimensions[0 if self.layout is 'portrait' else 1]
-        self.height = dimensions[1 if self.layout is 'portrait' else 0]
+        self.width = dimensions[0 if self.layout == 'portrait' else 1]
+        self.height = dimensions[1 if self.layout == 'portrait' else 0]
 
         self.x = self.margins['left']
         self.y = self.height - self.margins['top']
         self.available_width = self.width - self.x - self.margins['right']
 
-        self.content = document.ref()
+        self.open()
 
-        # Initialize the Font, XObject, and ExtGState dictionaries
-        self.resources = document.ref({
-            'ProcSet': ['PDF', 'Text', 'ImageB', 'ImageC', 'ImageI'],
-        })
+    def open(self):
+        """ Creates the page objects, draws the letterhead and margin content. """
+        document = self.document
+        self.content = document.ref()
 
         if self.document.letterhead and self.style.letterhead_page:
             letterhead_page = self.document.letterhead[int(self.style.letterhead_page)-1]
-            self.resources.meta.update({
-                'XObject': {letterhead_page.name: letterhead_page}
-            })
-            self.write('/{} Do\n'.format(letterhead_page.name))
+            self.xobject[letterhead_page.name] = letterhead_page
+            self.draw_xobject(letterhead_page.name)
+
+        # objects to write, known once the page is finished
+        self.refs = None
 
         # The page dictionary
         self.dictionary = document.ref({
             'Type': 'Page',
-            'Parent': document.root.meta['Pages'],
             'MediaBox': [0, 0, self.width, self.height],
             'Contents': self.content,
-            'Resources': self.resources,
         })
 
         if self.style.page_bottom_right_content:
-            style = self.style.set(font_size=9)
-            page_text = self.style.page_bottom_right_content(self)
-            text_width = stringWidth(page_text, style.font_name, style.font_size)
-            text = self.begin_text(
-                (self.margins['left'] + self.available_width) - text_width,
-                self.margins['bottom'] - style.leading*2
-            )
-            text.set_font(style.font_name, style.leading, style.font_size)
-            text.draw(page_text)
-            text.close()
+            self.draw_bottom_right(self.style.page_bottom_right_content)
+
+    def draw_bottom_right(self, content):
+        """
+        Static parts of the `content` come from forms drawn once per document,
+        only counters are drawn as text on every page. The total number of
+        pages is a form drawn at the end, room for a number of a few digits
+        is left for it so it doesn't run past the margin.
+        """
+        style = self.style.set(font_size=9)
+        runs = []
+        for part in content.parts:
+            if isinstance(part, str):
+                form, width = self.document.text_form(part, style)
+                runs.append((form, width))
+            elif part.name == 'pages':
+                form = self.document.total_pages_form(style)
+                runs.append((form, self.document.number_width(self, style)))
+            else:
+                runs.append(self.document.counter_run(self, part, style))
+        x = self.margins['left'] + self.available_width - sum(width for _, width in runs)
+        y = self.margins['bottom'] - style.leading*2
+        for run, width in runs:
+            if isinstance(run, str):
+                text = self.begin_text(x, y)
+                text.set_font(style.font_name, style.font_size, style.leading)
+                text.draw(run)
+                text.close()
+            else:
+                run.place(self, x, y - run.baseline)
+            x += width
 
     @property
     def page_number(self):
@@ -74,53 +94,77 @@ class PDFPage:
 
     @property
     def has_content(self):
-        return self.content.has_content
+        return bool(self.stream or self.borders) or self.content.has_content
 
     @property
     def available_height(self):
         return self.y - self.margins['bottom']
 
-    @property
-    def font(self):
-        if 'Font' not in self.resources.meta:
-            self.resources.meta['Font'] = {}
-        return self.resources.meta['Font']
-
-    def write(self, chunk):
-        self.content.write(chunk.encode())
+    def finish(self):
+        """
+        Moves the content built so far into the content stream object
+        and looks up the resources dictionary in the shared ones.
+        """
+        content = self.flush()
+        if content:
+            self.content.write(content)
+        if self.refs is None:
+            resources, is_new = self.document.resources_reference(self.resources)
+            self.dictionary.meta['Resources'] = resources
+            self.refs = (self.dictionary, resources, self.content) if is_new else (self.dictionary, self.content)
 
     def read(self):
-        for ref in (self.dictionary, self.resources, self.content):
+        self.finish()
+        for ref in self.refs:
             yield from self.document.finalize_reference(ref)
+        yield from self.document.read_pending()
 
-    def save_state(self):
-        self.write("q\n")
 
-    def restore_state(self):
-        self.write("Q\n")
+class PDFDryPage(PDFPage):
+    """
+    Page outside of the requested page range. It is laid out like any
+    other page, but what is drawn on it is only noted and it isn't written.
+    """
 
-    def translate(self, x, y):
-        self.write("1 0 0 1 {} {} cm\n".format(x, y))
+    dry = True
+
+    def open(self):
+        self.drawn = False
 
     def begin_text(self, x, y):
-        return PDFText(self, x, y)
+        return DryText(self)
+
+    @property
+    def has_content(self):
+        return self.drawn or bool(self.borders)
+
+    def finish(self):
+        pass
+
+    def read(self):
+        return self.document.read_pending()
+
+
+class DryText:
+    """ Text on a dry page: no fonts are looked up and nothing is shown. """
+
+    def __init__(self, page):
+        self.page = page
 
-    def line_width(self, width):
-        self.write("{} w\n".format(width))
+    def move_position(self, dx=0, dy=0):
+        pass
 
-    def stroke_color(self, r, g, b, a):
-        assert a == 1, "TODO: implement alpha"
-        self.write("{} {} {} RG\n".format(r, g, b))
+    def set_position(self, x=0, y=0):
+        pass
 
-    def line(self, x1, y1, x2, y2):
-        self.write("n {} {} m {} {} l S\n".format(x1, y1, x2, y2))
+    def set_font(self, font_name, size, leading):
+        pass
 
-    def fill_color(self, r, g, b, a):
-        assert a == 1, "TODO: implement alpha"
-        self.write("{} {} {} rg\n".format(r, g, b))
+    def draw(self, txt, new_line=False):
+        self.page.drawn = True
 
-    def rectangle(self, x, y, width, height):
-        self.write("n {} {} {} {} re f*\n".format(x, y, width, height))
+    def close(self):
+        pass
 
 
 DEFAULT_MARGINS = {
@@ -1,32 +1,52 @@
+import zlib
 from pdfrw.objects import PdfObject, PdfString
+from .content import number
 
 
 def serialize(meta):
+    buffer = bytearray()
+    write_object(buffer, meta)
+    return bytes(buffer)
+
+
+def write_object(buffer, meta):
     if isinstance(meta, dict):
-        yield b'<<'
+        buffer += b'<<'
         for key, value in meta.items():
             if not key.startswith('/'):
-                key = '/'+key
-            yield '{} '.format(key).encode()
-            yield from serialize(value)
-            yield b' '
-        yield b'>>'
+                buffer += b'/'
+            buffer += key.encode()
+            buffer.append(32)
+            write_object(buffer, value)
+            buffer.append(32)
+        buffer += b'>>'
     elif isinstance(meta, (PdfObject, PdfString)):
-        yield str(meta).encode()
+        buffer += str(meta).encode()
     elif isinstance(meta, str):
         if meta.startswith('(') and meta.endswith(')'):
             pass
         elif not meta.startswith('/'):
-            meta = '/'+meta
-        yield meta.encode()
+            buffer += b'/'
+        buffer += meta.encode()
     elif isinstance(meta, list):
-        yield b'[ '
+        buffer += b'[ '
         for value in meta:
-            yield from serialize(value)
-            yield b' '
-        yield b']'
+            write_object(buffer, value)
+            buffer.append(32)
+        buffer += b']'
+    elif isinstance(meta, bool):
+        buffer += b'true' if meta else b'false'
+    elif isinstance(meta, (int, float)):
+        buffer += number(meta)
     else:
-        yield str(meta).encode()
+        buffer += str(meta).encode()
+
+
+def indirect(ref):
+    """
+    Reference to `ref` (7 0 R) which doesn't keep the object itself alive.
+    """
+    return PdfObject(str(ref))
 
 
 class PDFReference:
@@ -36,7 +56,6 @@ class PDFReference:
         self.meta = meta or {}
         self.gen = 0
         self.chunks = []
-        self.offset = None
         self.name = name
 
     def update(self, dict):
@@ -47,21 +66,29 @@ class PDFReference:
         self.meta['Length'] += len(chunk)
         self.chunks.append(chunk)
 
+    def compress(self, level):
+        if not self.chunks or 'Filter' in self.meta:
+            return
+        compressor = zlib.compressobj(level)
+        chunks = [compressor.compress(chunk) for chunk in self.chunks]
+        chunks.append(compressor.flush())
+        self.chunks = [chunk for chunk in chunks if chunk]
+        self.meta['Filter'] = 'FlateDecode'
+        self.meta['Length'] = sum(map(len, self.chunks))
+
     def read(self):
-        yield "{r.id} {r.gen} obj\n".format(r=self).encode()
-        yield from self.read_meta()
-        if self.chunks and not self.chunks[-1].endswith(b'\n'):
-            self.write(b'\n')
+        yield "{r.id} {r.gen} obj\n".format(r=self).encode() + self.serialize_meta()
         if self.chunks:
             yield b"stream\n"
             yield from self.chunks
+            if not self.chunks[-1].endswith(b'\n'):
+                yield b"\n"
             yield b"endstream\n"
             del self.chunks
         yield b"endobj\n"
 
-    def read_meta(self):
-        yield from serialize(self.meta)
-        yield b"\n"
+    def serialize_meta(self):
+        return serialize(self.meta) + b"\n"
 
     @property
     def has_content(self):
@@ -0,0 +1,286 @@
+import hashlib
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pdfrw.objects import PdfObject
+from reportlab.pdfbase.ttfonts import TTFont
+from .checkpoint import dump_subsets, load_subsets
+from .document import PDFDocument
+from .font import SUBSETN, getFont, read_font
+from .form import PDFForm
+from .letterhead import PDFLetterhead
+from .page import PDFPage
+from .reference import PDFReference, indirect, serialize
+from .stream import PDFStreamer
+
+__all__ = ('ShardedPDFStreamer',)
+
+
+REFERENCE = re.compile(r'(-?\d+) 0 R$')
+
+
+class Shard:
+    """ Objects of a section rendered by a worker, numbered from 1. """
+
+    __slots__ = ('ids', 'objects', 'pages', 'fonts', 'subsets', 'numbers', 'totals')
+
+    def __init__(self):
+        self.ids = []  # ids the merged document has to number
+        self.objects = []  # (id, meta, chunks)
+        self.pages = []  # page dictionary ids
+        self.fonts = []  # (font name, id), for fonts other than TrueType
+        self.subsets = []  # (font name, subset state, {subset name: id})
+        self.numbers = []  # (id, (font name, font size, leading), page number)
+        self.totals = []  # (id, name, (font name, font size, leading), height, baseline)
+
+
+class PDFShard(PDFDocument):
+    """
+    Document rendering a section in a worker. Objects are kept instead of
+    written, without a page tree or fonts. Page numbers are placeholders
+    for the merged document's forms of the numbers, which are known once
+    the section's first page is. The letterhead is written by the merged
+    document and referenced with negative ids.
+    """
+
+    def __init__(self, css, letterhead=None, layout='portrait', **options):
+        super().__init__(css, None, layout, **options)
+        self.shard = Shard()
+        if letterhead:
+            self.letterhead = PDFLetterhead.restore(self, [
+                PDFReference(-id, name=name) for name, id in letterhead
+            ])
+
+    def finalize_reference(self, ref):
+        if self.compress is not None:
+            ref.compress(self.compress)
+        self.shard.objects.append((ref.id, detach(ref.meta), ref.chunks))
+        return ()
+
+    def add_page(self):
+        self.page = PDFPage(self, len(self.shard.pages) + 1, self.css, 'a4', self.layout)
+        self.shard.pages.append(self.page.dictionary.id)
+        return self.page
+
+    def counter_run(self, page, counter, style):
+        if counter.name != 'page':
+            return super().counter_run(page, counter, style)
+        form = self.form(0, style.leading * 2)
+        self.shard.numbers.append((
+            form.ref.id, (style.font_name, style.font_size, style.leading), page.page_number
+        ))
+        form.baseline = style.leading
+        # numbers of pages in later sections have more digits than in the section
+        return form, self.number_width(page, style)
+
+    def finish(self):
+        """ Returns the `Shard` with everything the merged document needs. """
+        shard = self.shard
+        for key, form in self.total_pages_forms.items():
+            shard.totals.append((form.ref.id, form.name, key, form.height, form.baseline))
+        for font in self.delayedFonts:
+            if isinstance(font, TTFont):
+                state = font.state.pop(self)
+                prefix = '/{}+'.format(state.internalName)
+                shard.subsets.append((font.fontName, dump_subsets(state), {
+                    name: ref.id for name, ref in self.font_references.items() if name.startswith(prefix)
+                }))
+            else:
+                shard.fonts.append((font.fontName, self.font_references[self.fontMapping[font.fontName]].id))
+        shard.ids = [ref_id for ref_id, _, _ in shard.objects]
+        shard.ids.extend(total[0] for total in shard.totals)
+        return shard
+
+
+class ShardStreamer(PDFStreamer):
+    document_class = PDFShard
+
+
+def detach(value):
+    """ Copy of `value` with references as text, to be sent to another process. """
+    if isinstance(value, PDFReference):
+        return PdfObject(str(value))
+    if isinstance(value, dict):
+        return {key: detach(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    return value
+
+
+def renumber(value, ids):
+    if isinstance(value, dict):
+        return {key: renumber(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [renumber(item, ids) for item in value]
+    if isinstance(value, PdfObject):
+        match = REFERENCE.match(value)
+        if match:
+            ref_id = int(match.group(1))
+            return PdfObject('{} 0 R'.format(ids[ref_id] if ref_id > 0 else -ref_id))
+    return value
+
+
+# (stylesheet class, source) -> stylesheet, parsed once per worker process
+STYLESHEETS = {}
+
+
+def render_shard(section, parser, css, layout, letterhead, options):
+    """ Lays out `section` in a worker process, returns its `Shard`. """
+    if css not in STYLESHEETS:
+        stylesheet, src = css
+        STYLESHEETS[css] = stylesheet(src)
+    streamer = ShardStreamer(parser(section, STYLESHEETS[css]), letterhead, layout, **options)
+    for _ in streamer.page_parts():
+        pass
+    return streamer.pdf.finish()
+
+
+class ShardedPDFStreamer:
+    """
+    Renders `sections` in parallel and yields them merged into one PDF.
+
+    Each section is a callable like the `html_generator` of `HTMLParser`
+    and has to be picklable, for example a module level function or a
+    `functools.partial` of one; every section starts on a new page.
+    `parser` is called with a section and `css` in the worker and returns
+    the blocks to lay out, it has to be picklable too, for example
+    `HTMLParser` or `partial(HTMLParser, lookahead=20)`. The stylesheet
+    is parsed again from its source in the workers.
+    Sections are laid out by `workers` processes, or in `executor`, and
+    merged in order: objects are renumbered, pages are added to one page
+    tree, fonts and the letterhead are written once. Fonts registered
+    with reportlab have to be registered in the worker processes too,
+    which happens by itself when they are forked.
+
+    Extra `options` are passed on to `PDFDocument`. TrueType subsets are
+    embedded per section, identical ones only once.
+    """
+
+    def __init__(self, sections, parser, css, letterhead=None, layout='portrait',
+                 workers=None, executor=None, **options):
+        self.sections = sections
+        self.parser = parser
+        self.css = css
+        self.layout = layout
+        self.workers = workers
+        self.executor = executor
+        self.pdf = PDFDocument(css, letterhead, layout, **options)
+        # subsets are embedded by the merged document, workers don't need its cache
+        options.pop('subset_cache', None)
+        self.options = options
+        self.letterhead = [
+            (page.name, page.id) for page in self.pdf.letterhead.pages
+        ] if self.pdf.letterhead else None
+        self.totals = []
+        self.subsets = {}  # digest of TrueType subset objects -> id
+        self.tags = {}  # TrueType font name -> {glyphs of a subset: tag}
+
+    def __iter__(self):
+        for chunks in self.pages():
+            yield from chunks
+
+    def pages(self):
+        """ Yields the PDF in parts: the header, every section and the footer. """
+        yield list(self.pdf.header())
+        if self.executor:
+            yield from self.render(self.executor)
+        else:
+            with ProcessPoolExecutor(self.workers) as executor:
+                yield from self.render(executor)
+        for id, name, key, height, baseline in self.totals:
+            self.pdf.draw_number(self.form(id, name, height, baseline), key, self.pdf.pages.count)
+        yield list(self.pdf.footer())
+
+    def render(self, executor):
+        # keep every worker busy while holding on to only a few sections
+        ahead = 2 * (self.workers or os.cpu_count() or 1)
+        rendering = deque()
+        for section in self.sections:
+            rendering.append(executor.submit(
+                render_shard, section, self.parser, (type(self.css), self.css.src), self.layout,
+                self.letterhead, self.options
+            ))
+            while len(rendering) > ahead:
+                yield list(self.merge(rendering.popleft().result()))
+        while rendering:
+            yield list(self.merge(rendering.popleft().result()))
+
+    def form(self, id, name, height, baseline):
+        form = PDFForm(self.pdf, name, 0, height, id)
+        form.baseline = baseline
+        return form
+
+    def merge(self, shard):
+        pdf = self.pdf
+        ids = {ref_id: pdf.ref().id for ref_id in shard.ids}
+
+        for font_name, ref_id in shard.fonts:
+            ids[ref_id] = pdf.font_reference(getFont(font_name))[1].id
+        for font_name, state, subsets in shard.subsets:
+            font = getFont(font_name)
+            subset_document = SubsetDocument(pdf, self.subsets, self.tags, subsets)
+            font.state[subset_document] = load_subsets(font, state)
+            yield from read_font(subset_document, font)
+            del font.state[subset_document]
+            for name, ref_id in subsets.items():
+                ids[ref_id] = subset_document.font_references[name].id
+
+        first_page = pdf.pages.count
+        parents = {}
+        for ref_id in shard.pages:
+            parents[ref_id] = indirect(pdf.pages.add(PDFReference(ids[ref_id])))
+        for id, (font_name, font_size, leading), number in shard.numbers:
+            key = str(first_page + number), font_name, font_size, leading
+            form, _ = pdf.text_forms.get(key) or pdf.draw_text_form(key)
+            ids[id] = form.ref.id
+        for id, name, key, height, baseline in shard.totals:
+            self.totals.append((ids[id], name, key, height, baseline))
+
+        for ref_id, meta, chunks in shard.objects:
+            ref = PDFReference(ids[ref_id], renumber(meta, ids))
+            ref.chunks = chunks
+            if ref_id in parents:
+                ref.meta['Parent'] = parents[ref_id]
+            yield from pdf.finalize_reference(ref)
+        yield from pdf.read_pending()
+
+
+class SubsetDocument:
+    """
+    Stands in for the worker's document when writing the TrueType subsets
+    assigned there. Objects are numbered as they are written, objects
+    identical to ones written for an earlier section are reused. Subsets
+    are tagged by their glyphs, so sections with the same subset share
+    its tag and every other subset gets one of its own.
+    """
+
+    def __init__(self, document, written, tags, names):
+        self.document = document
+        self.written = written
+        self.tags = tags
+        self.font_references = {name: PDFReference(None) for name in names}
+        self.compress = document.compress
+        self.subset_cache = document.subset_cache
+
+    def ref(self, meta=None, name=None):
+        return PDFReference(None, meta, name)
+
+    def subset_tag(self, font, n, subset):
+        name = font.face.name + font.face.subfontNameX
+        tags = self.tags.setdefault(name, {})
+        glyphs = tuple(subset)
+        if glyphs not in tags:
+            tags[glyphs] = SUBSETN(self.document.subset_numbers.get(name, 0) + len(tags))
+        return tags[glyphs]
+
+    def finalize_reference(self, ref):
+        digest = hashlib.sha1(serialize(ref.meta))
+        for chunk in ref.chunks:
+            digest.update(chunk)
+        key = digest.digest()
+        ref.id = self.written.get(key)
+        if ref.id is not None:
+            return ()
+        ref.id = self.written[key] = self.document.ref().id
+        return self.document.finalize_reference(ref)
@@ -1,16 +1,235 @@
+import io
+import os
+import hashlib
+import asyncio
+from array import array
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from .document import PDFDocument
 
+__all__ = ('PDFStreamer', 'AsyncPDFStreamer')
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+CHECKPOINT_INTERVAL = 1000
+
+
+def writev(fd, chunks):
+    """ Writes all `chunks` to `fd`, retrying partial writes. """
+    written = 0
+    for start in range(0, len(chunks), IOV_MAX):
+        batch = chunks[start:start+IOV_MAX]
+        while batch:
+            remaining = os.writev(fd, batch)
+            written += remaining
+            done = 0
+            while done < len(batch) and remaining >= len(batch[done]):
+                remaining -= len(batch[done])
+                done += 1
+            batch = batch[done:]
+            if remaining:
+                batch[0] = memoryview(batch[0])[remaining:]
+    return written
+
+
+def sink_writer(sink):
+    """
+    Returns a function writing a list of chunks to `sink` and returning
+    the number of bytes written. File descriptors and objects backed by
+    one get vectored writes, anything else with a `write` method gets
+    the chunks joined into a single write.
+    """
+    fd = sink
+    if not isinstance(sink, int):
+        try:
+            fd = sink.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        def write(chunks):
+            data = b''.join(chunks)
+            sink.write(data)
+            return len(data)
+        return write
+    if hasattr(sink, 'flush'):
+        sink.flush()
+    return lambda chunks: writev(fd, chunks)
+
 
 class PDFStreamer:
+    """
+    Lays out blocks from `block_generator` onto pages and yields the PDF.
+
+    Extra `options` are passed on to `PDFDocument`, e.g. `compress=6` to
+    Flate encode streams or `update=path` to render pages to be appended
+    to the PDF at `path` as an incremental update. With compression
+    enabled `compress_workers` threads compress finished pages while the
+    next ones are laid out. TrueType subsets are taken from the process
+    wide `subset_cache` unless another `SubsetCache` is passed.
+    With `chunk_size` set output is coalesced into chunks of about that
+    many bytes, flushed at least at the end of every page. With
+    `page_range`, e.g. `range(1, 4)`, only those pages are drawn and
+    written, layout stops after the last one unless the total number
+    of pages is shown. An empty `page_range` raises `ValueError`.
 
-    def __init__(self, block_generator, letterhead=None, layout='portrait'):
+    With a `checkpoint` callable it is called every `checkpoint_interval`
+    pages or so with the offset reached and the document state. Only page
+    boundaries where the next page starts with a new block qualify, blocks
+    split across pages are not resumable. Passing that state as `resume`
+    to a new streamer over the same source yields the rest of the PDF, to
+    be appended to the output truncated at the offset. The blocks before
+    the checkpoint are parsed again and skipped, a `ValueError` is raised
+    if they differ from the ones laid out when it was taken.
+    """
+
+    document_class = PDFDocument
+
+    def __init__(self, block_generator, letterhead=None, layout='portrait', compress_workers=0,
+                 chunk_size=None, checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+                 resume=None, **options):
         self.generator = block_generator
-        self.pdf = PDFDocument(block_generator.css, letterhead, layout)
+        self.chunk_size = chunk_size
+        self.resumed = resume is not None
+        self.pdf = self.document_class(block_generator.css, None if self.resumed else letterhead, layout, **options)
+        # number of blocks laid out on the pages written so far and their digest
+        self.cursor = self.pdf.restore(resume) if self.resumed else (0, None)
+        self.digest = hashlib.sha1()
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_at = self.pdf.pages.count + checkpoint_interval
+        self.compress_workers = compress_workers if self.pdf.compress is not None else 0
+        self.executor = None
+        self.pending = deque()
+
+    def read_page(self, page, checkpoint=None):
+        """
+        Yields the chunks of `page`, or of pages finished before it. With
+        `checkpoint`, the number and digest of the blocks laid out before
+        the next page, one is taken if due: every page is read first and
+        the objects packed so far go out with the last one, so each part
+        is still a page.
+        """
+        page.finish()
+        due = checkpoint is not None and self.checkpoint_due
+        parts = []
+        if page.dry or not self.executor:
+            parts.append(list(page.read()))
+        else:
+            # zlib releases the GIL, compress in the background and
+            # only hold on to as many pages as there are workers
+            self.pending.append((page, self.executor.submit(page.content.compress, self.pdf.compress)))
+        while len(self.pending) > (0 if due else self.compress_workers):
+            parts.append(self.read_pending())
+        if due:
+            parts[-1].extend(self.pdf.read_object_stream())
+        for chunks in parts:
+            if chunks:
+                yield chunks
+        if due:
+            self.save_checkpoint(*checkpoint)
+
+    def read_pending(self):
+        page, compressed = self.pending.popleft()
+        compressed.result()
+        return list(page.read())
 
     def __iter__(self):
-        yield from self.pdf.header()
+        if not self.chunk_size:
+            for chunks in self.pages():
+                yield from chunks
+            return
+        buffer = bytearray()
+        for chunks in self.pages():
+            for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= self.chunk_size:
+                    yield bytes(buffer)
+                    del buffer[:]
+            if buffer:
+                yield bytes(buffer)
+                del buffer[:]
+
+    def write_to(self, sink):
+        """
+        Renders the whole PDF into `sink`, a file descriptor, a file object
+        or socket or anything else with a `write` method. Every page is
+        handed over in a single (vectored) write.
+
+        Returns the size of the PDF, counting the part before the
+        checkpoint when resuming, and an array with the offset at which
+        each page's objects start.
+        """
+        write = sink_writer(sink)
+        page_offsets = array('Q')
+        written = self.pdf.offset if self.resumed else write(list(self.pdf.header()))
+        for chunks in self.page_parts():
+            page_offsets.append(written)
+            written += write(chunks)
+        written += write(list(self.pdf.footer()))
+        if not isinstance(sink, int) and getattr(sink, 'seekable', lambda: False)():
+            # bring a buffered file object's position in sync with the descriptor
+            sink.seek(0, io.SEEK_CUR)
+        return written, page_offsets
+
+    def pages(self):
+        """
+        Yields the PDF in parts: the header, a list of chunks
+        for every page and finally the footer.
+        """
+        if not self.resumed:
+            yield list(self.pdf.header())
+        yield from self.page_parts()
+        yield self.pdf.footer()
+
+    def page_parts(self):
+        if self.compress_workers:
+            with ThreadPoolExecutor(self.compress_workers) as self.executor:
+                yield from self.layout()
+                while self.pending:
+                    yield self.read_pending()
+            self.executor = None
+        else:
+            yield from self.layout()
+
+    @property
+    def checkpoint_due(self):
+        return bool(self.checkpoint) and self.pdf.pages.count >= self.checkpoint_at
+
+    def save_checkpoint(self, cursor, digest):
+        """
+        Takes a checkpoint between pages, `cursor` blocks were laid
+        out before it, `digest` is theirs.
+        """
+        self.checkpoint_at = self.pdf.pages.count + self.checkpoint_interval
+        self.checkpoint(self.pdf.offset, self.pdf.checkpoint([cursor, digest.hexdigest()]))
+
+    def skip(self, blocks):
+        """
+        Skips the blocks laid out before the checkpoint resumed from,
+        returns their number.
+        """
+        count, digest = self.cursor
+        if not count:
+            return 0
+        for block in islice(blocks, count):
+            block.fingerprint(self.digest)
+        if self.digest.hexdigest() != digest:
+            raise ValueError('the source differs from the one the checkpoint was taken of')
+        return count
+
+    def layout(self):
         page = None
-        for block in self.generator:
+        blocks = iter(self.generator)
+        for cursor, block in enumerate(blocks, self.skip(blocks)):
+            # digests of the blocks before this one and up to this one
+            prefix = digest = self.digest
+            if self.checkpoint:
+                digest = self.digest = prefix.copy()
+                block.fingerprint(digest)
             while block:
                 page_created = False
                 if page is None:
@@ -19,13 +238,17 @@ class PDFStreamer:
                 _, requested_height = block.wrap(page, page.available_width)
                 if block.style.page_break_before:
                     if not page_created:
-                        yield from page.read()
+                        yield from self.read_page(page, (cursor, prefix))
+                        if self.pdf.range_complete:
+                            return
                         page = self.pdf.add_page()
                         _, requested_height = block.wrap(page, page.available_width)
                 if requested_height <= page.available_height:
                     page.x, page.y = block.draw(page, page.x, page.y)
                     if block.style.page_break_after:
-                        yield from page.read()
+                        yield from self.read_page(page, (cursor + 1, digest))
+                        if self.pdf.range_complete:
+                            return
                         page = None
                     break
                 else:
@@ -34,8 +257,58 @@ class PDFStreamer:
                         remainder.wrap(page, page.available_width)
                         page.x, page.y = remainder.draw(page, page.x, page.y)
                     assert page.has_content
-                    yield from page.read()
+                    yield from self.read_page(page, None if block else (cursor + 1, digest))
+                    if self.pdf.range_complete:
+                        return
                     page = None
         if page:
-            yield from page.read()
-        yield from self.pdf.footer()
+            yield from self.read_page(page)
+
+
+async def fetch(source):
+    return await source.__anext__()
+
+
+class AsyncPDFStreamer:
+    """
+    Streams a PDF from an async source of HTML.
+
+    `html_generator` is a callable returning an async iterable of HTML
+    snippets. `parser` is called with a callable returning them as a
+    blocking generator and returns the blocks to lay out, for example
+    `partial(HTMLParser, css=css)`. The remaining arguments are the same
+    as for `PDFStreamer`. Parsing and layout run in `executor` (the loop's
+    default executor when None) one page at a time, so the event loop is
+    never blocked by layout. Snippets are pulled from the async source on
+    the event loop whenever the parser asks for more.
+    """
+
+    def __init__(self, html_generator, parser, letterhead=None, layout='portrait', executor=None, **options):
+        self.html_generator = html_generator
+        self.executor = executor
+        self.streamer = PDFStreamer(parser(self.pull), letterhead, layout, **options)
+        self.loop = None
+        self.parts = None
+
+    def pull(self):
+        source = self.html_generator().__aiter__()
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(fetch(source), self.loop).result()
+            except StopAsyncIteration:
+                break
+
+    def read_part(self):
+        part = next(self.parts, None)
+        return None if part is None else b''.join(part)
+
+    def __aiter__(self):
+        self.loop = asyncio.get_event_loop()
+        self.parts = self.streamer.pages()
+        return self
+
+    async def __anext__(self):
+        chunk = await self.loop.run_in_executor(self.executor, self.read_part)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
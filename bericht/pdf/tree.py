@@ -0,0 +1,64 @@
+from .reference import indirect
+
+__all__ = ('PDFPageTree',)
+
+
+FANOUT = 32
+
+
+class PDFPageTree:
+    """
+    Balanced /Pages tree built while pages are added.
+
+    Only the spine, the last open node of every level, is kept in memory.
+    Nodes are moved to `finished` as soon as they are full, to be written
+    out by the document, the remaining spine is closed by `close`.
+    """
+
+    def __init__(self, document, fanout=FANOUT):
+        self.document = document
+        self.fanout = fanout
+        self.count = 0
+        self.spine = []  # open node of every level, leaves first
+        self.finished = []
+
+    def node(self, level):
+        if level == len(self.spine):
+            self.spine.append(None)
+        if self.spine[level] is None:
+            self.spine[level] = self.document.ref({'Type': 'Pages', 'Kids': [], 'Count': 0})
+        return self.spine[level]
+
+    def add(self, page):
+        """ Adds the `page` dictionary, returns its parent node. """
+        self.count += 1
+        leaf = self.node(0)
+        leaf.meta['Kids'].append(indirect(page))
+        leaf.meta['Count'] += 1
+        if len(leaf.meta['Kids']) == self.fanout:
+            self.attach(0)
+        return leaf
+
+    def attach(self, level):
+        """ Moves the open node of `level` into its parent and finishes it. """
+        node = self.spine[level]
+        self.spine[level] = None
+        parent = self.node(level + 1)
+        parent.meta['Kids'].append(indirect(node))
+        parent.meta['Count'] += node.meta['Count']
+        node.meta['Parent'] = indirect(parent)
+        self.finished.append(node)
+        if len(parent.meta['Kids']) == self.fanout:
+            self.attach(level + 1)
+
+    def close(self):
+        """ Attaches what is left of the spine, returns the root node. """
+        level = 0
+        while level < len(self.spine) - 1:
+            if self.spine[level] is not None:
+                self.attach(level)
+            level += 1
+        root = self.node(len(self.spine) - 1 if self.spine else 0)
+        self.spine = []
+        self.finished.append(root)
+        return root
@@ -0,0 +1,86 @@
+from array import array
+from pdfrw import PdfReader
+from pdfrw.objects import PdfObject
+from .font import subset_number
+from .letterhead import PDFLetterhead
+from .reference import PDFReference, indirect
+
+__all__ = ('PDFUpdate',)
+
+
+class PDFUpdate:
+    """
+    PDF written by `PDFDocument` which new pages are appended to as an
+    incremental update: the new objects, the root /Pages node with the new
+    pages attached and a cross-reference section chained to the previous
+    one by /Prev. Type1 fonts and letterhead XObjects of the existing pages
+    are referenced instead of written again, TrueType subsets are tagged
+    after the ones in the file.
+    """
+
+    def __init__(self, document, path):
+        with open(path, 'rb') as pdf:
+            data = pdf.read()
+        reader = PdfReader(fdata=data)
+        pages = reader.Root.Pages
+        fonts, letterhead, subsets = {}, {}, {}
+        seen = set()
+        for page in reader.pages:
+            resources = page.Resources
+            if resources is None or id(resources) in seen:
+                continue
+            seen.add(id(resources))
+            for font in (resources.Font or {}).values():
+                if font.Subtype == '/Type1':
+                    fonts.setdefault(font.BaseFont[1:], font)
+                elif font.Subtype == '/TrueType' and font.BaseFont[7:8] == '+':
+                    # subsets appended are tagged after the ones in the file
+                    number = subset_number(font.BaseFont[1:7])
+                    if number is not None:
+                        face = font.BaseFont[8:].encode('pdfdoc')
+                        subsets[face] = max(subsets.get(face, 0), number + 1)
+            for name, xobject in (resources.XObject or {}).items():
+                if name.startswith('/Letterhead'):
+                    letterhead[int(name[11:])] = name[1:], xobject
+        # objects are loaded lazily, number them once all are loaded
+        ids = {id(obj): key[0] for key, obj in reader.indirect_objects.items()}
+
+        self.prev = int(data[data.rindex(b'startxref') + 9:].split()[0])
+        self.first_id = int(reader.Size)
+        self.pages = PDFReference(ids[id(pages)], {
+            'Type': 'Pages',
+            'Kids': [PdfObject('{} 0 R'.format(ids[id(kid)])) for kid in pages.Kids],
+            'Count': int(pages.Count),
+        })
+
+        document.offset = len(data)
+        document.ref_ids = self.first_id - 1
+        document.offsets = array('Q', [0]) * self.first_id
+        document.root = PDFReference(ids[id(reader.Root)])
+        document.info = PDFReference(ids[id(reader.Info)])
+        document.page_count = document.pages.count = self.pages.meta['Count']
+        if not data.startswith(b'xref', self.prev):
+            # continue with the kind of cross-reference section the file has
+            document.object_streams = True
+        document.subset_numbers = subsets
+        for font_name, font in fonts.items():
+            name = document.fontMapping[font_name] = '/F{}'.format(len(document.fontMapping)+1)
+            document.font_references[name] = PDFReference(ids[id(font)])
+        if letterhead:
+            document.letterhead = PDFLetterhead.restore(document, [
+                PDFReference(ids[id(xobject)], name=name) for name, xobject in
+                (letterhead[number] for number in sorted(letterhead))
+            ])
+
+    def attach(self, pages):
+        """ Adds the tree of new `pages` to the existing root node. """
+        pages.meta['Parent'] = indirect(self.pages)
+        self.pages.meta['Kids'].append(indirect(pages))
+        self.pages.meta['Count'] += pages.meta['Count']
+
+    def sections(self, size):
+        """ (start, end) object id ranges of the cross-reference section. """
+        # the free list head is repeated, some readers expect every section to start with it
+        if self.pages.id + 1 == self.first_id:
+            return [(0, 1), (self.pages.id, size)]
+        return [(0, 1), (self.pages.id, self.pages.id + 1), (self.first_id, size)]
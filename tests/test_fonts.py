@@ -1,9 +1,16 @@
+import io
 import os.path
+import tempfile
+from array import array
+from contextlib import redirect_stdout
 from utils import BaseTestCase
 from reportlab import rl_config
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from bericht.pdf import PDFDocument
+from bericht.html import metrics
+from bericht.html.box import Word
+from bericht.html.style import default as default_style
+from bericht.pdf import PDFDocument, SubsetCache
 
 rl_config.TTFSearchPath = [os.path.join(os.path.dirname(__file__), 'fonts')]
 
@@ -23,23 +30,168 @@ pdfmetrics.registerFontFamily(
 
 class TestFont(BaseTestCase):
 
-    def render(self, html, css=None):
+    html = "<p>some text &#931;</p>"
+    css = "p { font-family: Ubuntu; }"
+
+    def render(self, html, css=None, **options):
         parser = self.parse(html, css)
         p = next(iter(parser))
-        doc = PDFDocument(parser.css)
+        doc = PDFDocument(parser.css, **options)
         page = doc.add_page()
         p.wrap(page, page.available_width)
         p.draw(page, page.x, page.y)
-        for _ in doc.header():
-            pass
-        for _ in page.read():
-            pass
-        for _ in doc.footer():
-            pass
+        pdf = b''.join(doc.header())
+        pdf += b''.join(page.read())
+        pdf += b''.join(doc.footer())
+        return pdf
 
     def test_uninitialized_font_regression_helvetica(self):
         self.render("<table><tr><td>some text</td><td>&#931;</td></tr></table>")
 
+    def test_subset_selected_once(self):
+        page = PDFDocument(self.parse('').css).add_page()
+        txt = page.begin_text(0, 0)
+        txt.set_font('Ubuntu-Regular', 10, 12)
+        txt.draw('some ')
+        txt.draw('text')
+        txt.close()
+        self.assertEqual(bytes(page.stream).count(b' Tf'), 1)
+
     def test_uninitialized_font_regression_ubuntu(self):
         self.render("<table><tr><td>some text</td><td>&#931;</td></tr></table>",
                     "p { font-family: Ubuntu; }")
+
+    def test_subset_cache_reused_across_documents(self):
+        cache = SubsetCache()
+        first = self.render(self.html, self.css, subset_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        second = self.render(self.html, self.css, subset_cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(first, second)
+        self.assertEqual(first, self.render(self.html, self.css, subset_cache=SubsetCache(size=0)))
+
+    def test_subset_cache_compressed(self):
+        cache = SubsetCache()
+        uncached = self.render(self.html, self.css, compress=6, subset_cache=SubsetCache(size=0))
+        self.render(self.html, self.css, compress=6, subset_cache=cache)
+        self.assertEqual(self.render(self.html, self.css, compress=6, subset_cache=cache), uncached)
+        self.assertEqual(cache.hits, 1)
+        # compressed and uncompressed font programs are kept apart
+        self.render(self.html, self.css, subset_cache=cache)
+        self.assertEqual(cache.misses, 2)
+
+    def test_subset_cache_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = self.render(self.html, self.css, subset_cache=SubsetCache(directory=directory))
+            self.assertEqual(len(os.listdir(directory)), 1)
+            cache = SubsetCache(directory=directory)
+            self.assertEqual(self.render(self.html, self.css, subset_cache=cache), first)
+            self.assertEqual((cache.disk_hits, cache.misses), (1, 0))
+
+    def test_subset_cache_truncated_entry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = self.render(self.html, self.css, subset_cache=SubsetCache(directory=directory))
+            for size in (100, 5):
+                entry, = os.listdir(directory)
+                with open(os.path.join(directory, entry), 'r+b') as cached:
+                    cached.truncate(size)
+                cache = SubsetCache(directory=directory)
+                self.assertEqual(self.render(self.html, self.css, subset_cache=cache), first)
+                self.assertEqual((cache.disk_hits, cache.misses), (0, 1))
+
+    def test_subset_cache_write_failed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = self.render(self.html, self.css, subset_cache=SubsetCache(directory=directory))
+            entry, = os.listdir(directory)
+            # the entry can't replace a directory of the same name
+            os.remove(os.path.join(directory, entry))
+            os.mkdir(os.path.join(directory, entry))
+            cache = SubsetCache(directory=directory)
+            self.assertEqual(self.render(self.html, self.css, subset_cache=cache), first)
+            self.assertEqual(os.listdir(directory), [entry])
+            # nor be written to a missing directory
+            cache = SubsetCache(directory=os.path.join(directory, 'missing'))
+            self.assertEqual(self.render(self.html, self.css, subset_cache=cache), first)
+            self.assertEqual(cache.misses, 1)
+
+
+class TestFontMetrics(BaseTestCase):
+
+    texts = ['', 'some text', 'Grüße €5', 'Σ and ∑ ≤ ♥', '\U0001f600 \ufb01', 'ŀ' * 9]
+
+    def compile(self, directory, *fonts):
+        with redirect_stdout(io.StringIO()):
+            metrics.main(list(fonts) + ['-o', directory])
+
+    def test_same_widths_as_reportlab(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.compile(directory, 'Helvetica', 'Ubuntu-Regular')
+            for font_name in ('Helvetica', 'Ubuntu-Regular'):
+                font = metrics.FontMetrics.load(os.path.join(directory, font_name + '.metrics'))
+                self.assertEqual(font.name, font_name)
+                for text in self.texts:
+                    for size in (7, 8.5, 12):
+                        self.assertEqual(
+                            font.string_width(text, size),
+                            pdfmetrics.stringWidth(text, font_name, size)
+                        )
+
+    def test_tables_built_from_fonts(self):
+        for font_family in ('Helvetica', 'Times-Roman', 'Ubuntu'):
+            style = default_style.set(font_family=font_family, font_size=8.5)
+            for text in self.texts:
+                self.assertEqual(metrics.measure(text, style), pdfmetrics.stringWidth(text, style.font_name, 8.5))
+
+    def test_fallback_runs(self):
+        helvetica = metrics.font_metrics('Helvetica')
+        self.assertEqual(list(helvetica.split('Größe Σ∑ ✓\U0001f600')), [
+            (1, 'Größe '), (2, 'Σ∑'), (1, ' '), (3, '✓'), (0, '\U0001f600')
+        ])
+        font = pdfmetrics.getFont('Helvetica')
+        for text in self.texts:
+            self.assertEqual(
+                [(fallback.fontName, encoded) for fallback, encoded in PDFDocument.encode_type1(font, text) if encoded],
+                [(fallback.fontName, encoded) for fallback, encoded in
+                 pdfmetrics.unicode2T1(text, [font] + font.substitutionFonts)]
+            )
+
+    def test_measured_texts_least_recently_used_dropped(self):
+        font = metrics.FontMetrics.from_font(pdfmetrics.getFont('Helvetica'))
+        for number in range(metrics.MEASURED_SIZE):
+            font.string_width(str(number), 10)
+        font.string_width('0', 10)
+        font.string_width('new', 10)
+        self.assertEqual(len(font.measured), metrics.MEASURED_SIZE)
+        self.assertIn('0', font.measured)
+        self.assertNotIn('1', font.measured)
+
+    def test_stale_metrics_file_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'Helvetica.metrics')
+            font = metrics.FontMetrics.from_font(pdfmetrics.getFont('Helvetica'))
+            # version 1 files cut the coverage map off after the last width differing from the default
+            end = max(code for code, width in enumerate(font.widths) if width != font.default_width) + 1
+            font.widths, font.glyphs = font.widths[:end], font.glyphs[:end]
+            data = font.dump()
+            with open(path, 'wb') as stale:
+                stale.write(data[:8] + bytes([1]) + data[9:])
+            with self.assertRaises(ValueError):
+                metrics.FontMetrics.load(path)
+
+    def test_registered_metrics_measure_words(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.compile(directory, 'Ubuntu-Regular')
+            style = default_style.set(font_family='Ubuntu', font_size=10)
+            word = Word(style, 'Σome')
+            width = word.width
+            metrics.register(os.path.join(directory, 'Ubuntu-Regular.metrics'))
+            try:
+                self.assertIn('Ubuntu-Regular', metrics.METRICS)
+                self.assertEqual(word.width, width)
+                # every code point one em wide, from the registered tables and not the font
+                metrics.METRICS['Ubuntu-Regular'] = metrics.FontMetrics(
+                    'Ubuntu-Regular', metrics.TRUETYPE, 0, 0, 1000, array('d'), array('H')
+                )
+                self.assertEqual(Word(style, 'Σome').width, 40)
+            finally:
+                del metrics.METRICS['Ubuntu-Regular']
@@ -1,7 +1,8 @@
 from unittest import TestCase, skip
 from tinycss2 import parse_one_rule
 
-from bericht.html.css import parse_selectors
+from bericht.html.css import CSS, parse_selectors
+from bericht.pdf import PDFDocument
 from utils import BaseTestCase
 
 
@@ -100,3 +101,22 @@ class TestMatch(BaseTestCase):
         self.assertIsNotNone(even.style.background_color)
         self.assertIsNone(odd2.style.background_color)
         self.assertIsNotNone(even2.style.background_color)
+
+
+class TestPageRules(TestCase):
+
+    def test_content_value(self):
+        css = CSS('@page { @bottom-right { content: "Page " "no. " counter(page); } }')
+        page = PDFDocument(css).add_page()
+        content = page.style.page_bottom_right_content
+        self.assertEqual(content.parts[0], 'Page no. ')
+        self.assertFalse(content.static)
+        self.assertEqual(content(page), 'Page no. 1')
+
+    def test_page_styles_are_cached(self):
+        css = CSS('@page { margin-top: 10px; } p { margin-top: 5px; }')
+        self.assertEqual(len(css.page_rules), 1)
+        doc = PDFDocument(css)
+        first, second = doc.add_page(), doc.add_page()
+        self.assertEqual(first.margins['top'], 10)
+        self.assertIs(first.style, second.style)
@@ -1,4 +1,11 @@
+import sys
+from unittest import skipUnless
+try:
+    import resource
+except ImportError:
+    resource = None
 from bericht.pdf import PDFDocument
+from bericht.html import HTMLParser, CSS
 from utils import BaseTestCase
 
 
@@ -110,3 +117,64 @@ class TestRows(BaseTestCase):
     def test_two_rows(self):
         rows = self.get_rows(['hello', 'world'])
         self.assertEqual(len(rows), 2)
+
+
+class TestColumnMeasurement(BaseTestCase):
+
+    def get_widths(self, html, lookahead=None):
+        rows = list(self.parse(html, lookahead=lookahead))
+        table = rows[0].parent.parent.behavior
+        return table.get_column_widths(500)
+
+    def test_single_pass_matches_two_pass(self):
+        self.assertEqual(
+            self.get_widths(TABLE_HTML, lookahead=10),
+            self.get_widths(TABLE_HTML)
+        )
+
+    def test_single_pass_measures_only_lookahead_rows(self):
+        html = """
+        <table>
+          <colgroup><col width="0*"><col width="1*"></colgroup>
+          <tr><td>1<td>short
+          <tr><td>1000000<td>short
+        </table>"""
+        narrow, _ = self.get_widths(html, lookahead=1)
+        wide, _ = self.get_widths(html)
+        self.assertLess(narrow, wide)
+
+    def test_single_pass_reads_source_once(self):
+        calls = []
+
+        def html():
+            calls.append(1)
+            yield '<table><tr><td>1<td>2</tr><tr><td>3<td>4</tr></table>'
+            yield '<p>after</p>'
+
+        parser = HTMLParser(html, CSS(''), lookahead=1)
+        boxes = list(parser)
+        self.assertEqual([b.tag for b in boxes], ['tr', 'tr', 'p'])
+        self.assertEqual(len(calls), 1)
+
+
+class TestRootTableMemory(BaseTestCase):
+
+    @skipUnless(resource, 'requires the resource module')
+    def test_memory_stays_flat(self):
+        rows = 20000
+
+        def html():
+            yield '<table>'
+            for i in range(rows):
+                yield '<tr><td>{}</td><td>row {} with some text</td></tr>'.format(i, i)
+            yield '</table>'
+
+        def rss():
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform != 'darwin' else maxrss / 1024  # kilobytes
+
+        baseline = None
+        for i, _ in enumerate(HTMLParser(html, CSS(''), lookahead=10)):
+            if i == rows // 10:
+                baseline = rss()
+        self.assertLess(rss() - baseline, 6 * 1024)
@@ -1,8 +1,23 @@
+import gc
+import os
+import re
+import tempfile
+import zlib
+import asyncio
+import weakref
 from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
-from bericht.pdf import PDFStreamer
+from bericht.pdf import PDFStreamer, AsyncPDFStreamer, ShardedPDFStreamer, PDFDocument
+from bericht.pdf.content import ContentStream, number
+from bericht.pdf.optimize import optimize
 from bericht.html import HTMLParser, CSS
 from pdfrw import PdfReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+FONTS = os.path.join(os.path.dirname(__file__), 'fonts')
 
 
 class TestHTMLtoPDF(TestCase):
@@ -42,10 +57,677 @@ class TestHTMLtoPDF(TestCase):
         yield '</table>'
         yield '<p>last p</p>'
 
-    def test_html_to_pdf(self):
+    def render(self, **options):
         output = BytesIO()
-        for chunk in PDFStreamer(HTMLParser(self.html, CSS(''))):
+        for chunk in PDFStreamer(HTMLParser(self.html, CSS('')), **options):
             output.write(chunk)
-        pdf = PdfReader(fdata=output.getvalue())
+        return output.getvalue()
+
+    def test_html_to_pdf(self):
+        pdf = PdfReader(fdata=self.render())
+        self.assertEqual(pdf['/Info']['/Producer'], '(bericht)')
+        self.assertEqual(pdf['/Root']['/Pages']['/Count'], '3')
+
+    def test_compression(self):
+        plain = self.render()
+        compressed = self.render(compress=6)
+        self.assertLess(len(compressed), len(plain))
+        pdf = PdfReader(fdata=compressed)
+        self.assertEqual(pdf['/Root']['/Pages']['/Count'], '3')
+        content = pdf.pages[0].Contents
+        self.assertEqual(content.Filter, '/FlateDecode')
+        self.assertIn(b'BT', zlib.decompress(content.stream.encode('latin-1')))
+
+    def test_chunk_size(self):
+        def html():
+            # a single page showing many fonts, written as many small objects
+            for name in ('', 't', 'c'):
+                yield '<p class="{}">plain <b>bold</b> <i>italic</i> <b><i>both</i></b> Σ ✓</p>'.format(name)
+        css = '.t { font-family: Times-Roman; } .c { font-family: Courier; }'
+        chunks = list(PDFStreamer(HTMLParser(html, CSS(css)), chunk_size=4096))
+        plain = list(PDFStreamer(HTMLParser(html, CSS(css))))
+        self.assertEqual(b''.join(chunks), b''.join(plain))
+        self.assertLess(len(chunks), len(plain) // 10)
+
+    def test_write_to(self):
+        expected = self.render()
+        with tempfile.TemporaryFile() as output:
+            written, page_offsets = PDFStreamer(HTMLParser(self.html, CSS(''))).write_to(output)
+            self.assertEqual(output.tell(), written)
+            output.seek(0)
+            data = output.read()
+        self.assertEqual(data, expected)
+        self.assertEqual(written, len(expected))
+        self.assertEqual(len(page_offsets), 3)
+        for offset in page_offsets:
+            self.assertRegex(data[offset:offset+20], rb'^\d+ 0 obj\n')
+
+    def test_write_to_file_like(self):
+        output = BytesIO()
+        written, _ = PDFStreamer(HTMLParser(self.html, CSS(''))).write_to(output)
+        self.assertEqual(output.getvalue(), self.render())
+        self.assertEqual(written, len(output.getvalue()))
+
+    def test_optimize(self):
+        plain = self.render()
+        optimized = self.render(optimize=True)
+        self.assertLess(len(optimized), len(plain))
+        pdf = PdfReader(fdata=optimized)
+        self.assertEqual(pdf['/Root']['/Pages']['/Count'], '3')
+
+    def test_compression_workers(self):
+        self.assertEqual(
+            self.render(compress=6, compress_workers=2),
+            self.render(compress=6)
+        )
+
+    def test_object_streams(self):
+        data = self.render(object_streams=True)
+        self.assertNotIn(b'\nxref\n', data)
+        self.assertIn(b'/Type /ObjStm', data)
+        self.assertIn(b'/Type /XRef', data)
+        pdf = PdfReader(fdata=data)
         self.assertEqual(pdf['/Info']['/Producer'], '(bericht)')
         self.assertEqual(pdf['/Root']['/Pages']['/Count'], '3')
+        self.assertEqual(len(pdf.pages), 3)
+
+
+class TestPDFDocument(TestCase):
+
+    def test_finalized_page_references_are_released(self):
+        doc = PDFDocument(CSS(''))
+        page = doc.add_page()
+        page.write('0 0 m\n')
+        refs = [weakref.ref(ref) for ref in (page.dictionary, page.content)]
+        for _ in page.read():
+            pass
+        page = doc.add_page()
+        gc.collect()
+        self.assertEqual([ref() for ref in refs], [None, None])
+        self.assertEqual(len(doc.offsets), doc.ref_ids + 1)
+
+    def test_identical_resources_are_shared(self):
+        doc = PDFDocument(CSS(''))
+        f1, f2 = doc.ref(), doc.ref()
+
+        def render(*fonts):
+            page = doc.add_page()
+            for name, font in fonts:
+                page.font[name] = font
+            data = b''.join(page.read())
+            return str(page.dictionary.meta['Resources']), data
+
+        first, _ = render(('/F1', f1), ('/F2', f2))
+        second, data = render(('/F2', f2), ('/F1', f1))
+        third, _ = render(('/F1', f1))
+        self.assertEqual(first, second)
+        self.assertNotIn(b'/ProcSet', data)
+        self.assertNotEqual(first, third)
+
+    def test_repeated_text_encoded_once(self):
+        doc = PDFDocument(CSS(''))
+        streams = []
+        for _ in range(2):
+            page = doc.add_page()
+            text = page.begin_text(0, 0)
+            text.set_font('Helvetica', 10, 12)
+            text.draw('Σ total (€)')
+            text.close()
+            streams.append(bytes(page.stream))
+            self.assertEqual(sorted(page.font), ['/F1', '/F2'])
+        self.assertEqual(streams[0], streams[1])
+        self.assertIn(b'/F2 10 Tf\n12 TL\n', streams[0])
+        self.assertEqual(list(doc.texts), [('Helvetica', 'Σ total (€)')])
+        self.assertEqual(doc.fontMapping, {'Symbol': '/F1', 'Helvetica': '/F2'})
+
+
+class AsyncHTML:
+
+    def __init__(self, snippets):
+        self.snippets = iter(snippets)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await asyncio.sleep(0)
+        try:
+            return next(self.snippets)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class TestAsyncPDFStreamer(TestCase):
+
+    def test_matches_sync_output(self):
+        html = TestHTMLtoPDF().html
+
+        async def render():
+            chunks = []
+            async for chunk in AsyncPDFStreamer(lambda: AsyncHTML(html()), partial(HTMLParser, css=CSS(''))):
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+        loop = asyncio.new_event_loop()
+        try:
+            data = loop.run_until_complete(render())
+        finally:
+            loop.close()
+        self.assertEqual(data, b''.join(PDFStreamer(HTMLParser(html, CSS('')))))
+
+
+class TestPageTree(TestCase):
+
+    def test_balanced_tree(self):
+        def html():
+            for i in range(70):
+                yield '<p>page {}</p>'.format(i+1)
+        streamer = PDFStreamer(HTMLParser(html, CSS('p { page-break-after: always; }')))
+        streamer.pdf.pages.fanout = 4
+        pdf = PdfReader(fdata=b''.join(streamer))
+        self.assertEqual(len(pdf.pages), 70)
+        root = pdf['/Root']['/Pages']
+        self.assertEqual(root['/Count'], '70')
+        self.assertIsNone(root.Parent)
+
+        def depths(node, depth=0):
+            if node.Type == '/Page':
+                self.assertEqual(node.Contents.stream.count('page'), 1)
+                return {depth}
+            self.assertLessEqual(len(node.Kids), 4)
+            self.assertEqual(int(node.Count), sum(int(kid.Count or 1) for kid in node.Kids))
+            for kid in node.Kids:
+                self.assertIs(kid.Parent, node)
+            return set().union(*(depths(kid, depth+1) for kid in node.Kids))
+
+        self.assertEqual(depths(root), {4})
+
+
+class TestHeaderXObjects(TestCase):
+
+    def html(self):
+        yield '<table><thead><tr><td>header one<td>header two</tr></thead>'
+        for i in range(120):
+            yield '<tr><td>row {}<td>cell</tr>'.format(i)
+        yield '</table>'
+
+    def render(self, **options):
+        css = CSS('td { border-width: 1px; }')
+        return b''.join(PDFStreamer(HTMLParser(self.html, css), **options))
+
+    def test_header_drawn_once(self):
+        data = self.render(header_xobjects=True)
+        pdf = PdfReader(fdata=data)
+        self.assertGreater(len(pdf.pages), 2)
+        self.assertEqual(data.count(b'(header one)'), 1)
+        self.assertEqual(data.count(b'/Subtype /Form'), 1)
+        for page in pdf.pages:
+            form = page.Resources.XObject.Form1
+            self.assertEqual(form.Subtype, '/Form')
+            self.assertIn('/Form1 Do', page.Contents.stream)
+            self.assertNotIn('header', page.Contents.stream)
+        self.assertIn('(header one)', form.stream)
+        self.assertIn('/F1', form.Resources.Font)
+
+    def test_same_layout(self):
+        plain = PdfReader(fdata=self.render())
+        forms = PdfReader(fdata=self.render(header_xobjects=True))
+        self.assertEqual(len(plain.pages), len(forms.pages))
+        for plain_page, forms_page in zip(plain.pages, forms.pages):
+            rows = [line for line in plain_page.Contents.stream.splitlines() if line.startswith('(row')]
+            self.assertEqual(
+                rows,
+                [line for line in forms_page.Contents.stream.splitlines() if line.startswith('(row')]
+            )
+
+    def test_same_borders_and_fills(self):
+        def html():
+            yield '<table><thead><tr><td class="h">header one<td class="h">header two</tr></thead>'
+            for i in range(120):
+                yield '<tr><td>row {}<td>cell</tr>'.format(i)
+            yield '</table>'
+
+        def paths(stream, dx=0, dy=0):
+            for line in stream.splitlines():
+                *operands, operator = line.split()
+                if operator in ('m', 'l'):
+                    yield operator, round(float(operands[0])+dx, 2), round(float(operands[1])+dy, 2)
+                elif operator == 're':
+                    x, y, width, height = map(float, operands)
+                    yield operator, round(x+dx, 2), round(y+dy, 2), width, height
+                elif operator in ('w', 'RG', 'rg', 'S', 'f'):
+                    yield (operator,) + tuple(operands)
+
+        css = CSS('td.h { border-width: 4px; background-color: #eeeeee; }')
+        plain = PdfReader(fdata=b''.join(PDFStreamer(HTMLParser(html, css))))
+        forms = PdfReader(fdata=b''.join(PDFStreamer(HTMLParser(html, css), header_xobjects=True)))
+        for plain_page, forms_page in zip(plain.pages[:2], forms.pages[:2]):
+            form = forms_page.Resources.XObject.Form1
+            placed = forms_page.Contents.stream.split('/Form1 Do')[0].split()
+            dx, dy = map(float, placed[placed.index('cm')-2:placed.index('cm')])
+            self.assertEqual(list(paths(form.stream, dx, dy)), list(paths(plain_page.Contents.stream)))
+            # strokes on the edges of the cells are inside the form
+            left, bottom, right, top = map(float, form.BBox)
+            for _, x, y in (path for path in paths(form.stream) if path[0] in ('m', 'l')):
+                self.assertTrue(left + 2 <= x <= right - 2 and bottom + 2 <= y <= top - 2)
+
+
+class TestMarginContent(TestCase):
+
+    def test_static_text_drawn_once(self):
+        def html():
+            for i in range(3):
+                yield '<p>page {}</p>'.format(i+1)
+        css = CSS(
+            'p { page-break-after: always; }'
+            '@page { @bottom-right { content: "Page " counter(page); } }'
+        )
+        data = b''.join(PDFStreamer(HTMLParser(html, css)))
+        self.assertEqual(data.count(b'(Page ) Tj'), 1)
+        pdf = PdfReader(fdata=data)
+        for number, page in enumerate(pdf.pages, 1):
+            self.assertIn('/Form1 Do', page.Contents.stream)
+            self.assertIn('({}) Tj'.format(number), page.Contents.stream)
+            self.assertIn('/F1 9 Tf', page.Contents.stream)
+
+    def test_total_pages(self):
+        def html():
+            for i in range(12):
+                yield '<p>page {}</p>'.format(i+1)
+        css = CSS(
+            'p { page-break-after: always; }'
+            '@page { @bottom-right { content: "Page " counter(page) " of " counter(pages); } }'
+        )
+        data = b''.join(PDFStreamer(HTMLParser(html, css)))
+        self.assertEqual(data.count(b'(12) Tj'), 2)  # last page and the total
+        pdf = PdfReader(fdata=data)
+        self.assertEqual(len(pdf.pages), 12)
+        for page in pdf.pages:
+            total = page.Resources.XObject.Form3
+            self.assertIn('/Form3 Do', page.Contents.stream)
+        self.assertIn('(12) Tj', total.stream)
+        self.assertIn('/F1', total.Resources.Font)
+
+    def test_total_pages_within_margin(self):
+        def html():
+            for i in range(12):
+                yield '<p>page {}</p>'.format(i+1)
+        css = CSS(
+            'p { page-break-after: always; }'
+            '@page { @bottom-right { content: "Page " counter(page) " of " counter(pages); } }'
+        )
+        pdf = PdfReader(fdata=b''.join(PDFStreamer(HTMLParser(html, css))))
+        for page in pdf.pages:
+            placed = page.Contents.stream.split('/Form3 Do')[0].split()
+            x = float(placed[placed.index('cm', len(placed)-8)-2])
+            right = float(page.MediaBox[2]) - 72
+            self.assertLessEqual(x + pdfmetrics.stringWidth('12', 'Helvetica', 9), right)
+
+
+class TestCheckpoint(TestCase):
+
+    css = (
+        'p { page-break-after: always; }'
+        'p.ttf { font-family: "Ubuntu-Regular"; }'
+        '@page { @bottom-right { content: "Page " counter(page) " of " counter(pages); } }'
+    )
+
+    def html(self):
+        for i in range(9):
+            yield '<p>page {}</p>'.format(i+1)
+            yield '<p class="ttf">üñíçødé {}</p>'.format(chr(0x100 + i))
+
+    def render(self, **options):
+        pdfmetrics.registerFont(TTFont('Ubuntu-Regular', os.path.join(FONTS, 'Ubuntu-Regular.ttf')))
+        return b''.join(PDFStreamer(HTMLParser(self.html, CSS(self.css)), **options))
+
+    def test_resume(self):
+        expected = self.render()
+        checkpoints = []
+        data = self.render(checkpoint=lambda *state: checkpoints.append(state), checkpoint_interval=4)
+        self.assertEqual(data, expected)
+        self.assertEqual(len(checkpoints), 4)
+        for offset, state in checkpoints:
+            self.assertEqual(data[:offset] + self.render(resume=state), expected)
+
+    def test_resume_compressed(self):
+        expected = self.render(compress=6)
+        checkpoints = []
+        self.render(compress=6, compress_workers=2, checkpoint_interval=5,
+                    checkpoint=lambda *state: checkpoints.append(state))
+        offset, state = checkpoints[0]
+        self.assertEqual(expected[:offset] + self.render(compress=6, resume=state), expected)
+
+    def test_page_offsets(self):
+        checkpoints = []
+        html = lambda: ('<p>page {}</p>'.format(i+1) for i in range(30))
+        options = dict(object_streams=True, checkpoint_interval=5, checkpoint=lambda *state: checkpoints.append(state))
+        with tempfile.TemporaryFile() as pdf:
+            written, offsets = PDFStreamer(HTMLParser(html, CSS(self.css)), **options).write_to(pdf)
+            self.assertEqual(len(checkpoints), 6)
+            self.assertEqual(len(offsets), 30)
+            self.assertEqual(list(offsets), sorted(offsets))
+            # each checkpoint is taken at the end of a page
+            self.assertTrue({offset for offset, _ in checkpoints[:-1]} <= set(offsets))
+            offset, state = checkpoints[2]
+            pdf.truncate(offset)
+            pdf.seek(offset)
+            streamer = PDFStreamer(HTMLParser(html, CSS(self.css)), resume=state, **options)
+            resumed, resumed_offsets = streamer.write_to(pdf)
+        self.assertEqual(resumed, written)
+        self.assertEqual(list(resumed_offsets), list(offsets[15:]))
+
+    def test_resume_keeps_info(self):
+        checkpoints = []
+        streamer = PDFStreamer(
+            HTMLParser(self.html, CSS(self.css)), checkpoint_interval=4,
+            checkpoint=lambda *state: checkpoints.append(state)
+        )
+        streamer.pdf.info.meta['Title'] = '(Report)'
+        data = b''.join(streamer)
+        offset, state = checkpoints[0]
+        pdf = PdfReader(fdata=data[:offset] + self.render(resume=state))
+        self.assertEqual(pdf.Info.Title, '(Report)')
+        self.assertEqual(pdf.Info.Producer, '(bericht)')
+
+    def test_resume_changed_source(self):
+        checkpoints = []
+        self.render(checkpoint=lambda *state: checkpoints.append(state), checkpoint_interval=4)
+        html = self.html
+        self.html = lambda: (chunk.replace('page 2', 'page two') for chunk in html())
+        with self.assertRaises(ValueError):
+            self.render(resume=checkpoints[0][1])
+        # changes after the checkpoint are fine
+        self.html = lambda: (chunk.replace('page 9', 'page nine') for chunk in html())
+        self.assertIn(b'(page nine)', self.render(resume=checkpoints[0][1]))
+
+
+class TestIncrementalUpdate(TestCase):
+
+    css = 'p { page-break-after: always; } @page { letterhead-page: 1; }'
+
+    def html(self, first, count):
+        def html():
+            for i in range(first, first+count):
+                yield '<p>page {}</p>'.format(i)
+        return html
+
+    def append(self, first, count, **options):
+        with open(self.path, 'ab') as pdf:
+            PDFStreamer(HTMLParser(self.html(first, count), CSS(self.css)), update=self.path, **options).write_to(pdf)
+
+    def check(self, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            letterhead = os.path.join(directory, 'letterhead.pdf')
+            with open(letterhead, 'wb') as pdf:
+                PDFStreamer(HTMLParser(self.html(0, 1), CSS(''))).write_to(pdf)
+            self.path = os.path.join(directory, 'ledger.pdf')
+            with open(self.path, 'wb') as pdf:
+                streamer = PDFStreamer(HTMLParser(self.html(1, 3), CSS(self.css)), letterhead, **options)
+                streamer.write_to(pdf)
+            self.append(4, 2, **options)
+            self.append(6, 40, **options)
+            with open(self.path, 'rb') as pdf:
+                data = pdf.read()
+        self.assertEqual(data.count(b'%PDF-'), 1)
+        self.assertEqual(data.count(b'/Prev '), 2)
+        pdf = PdfReader(fdata=data)
+        self.assertEqual(pdf.Root.Pages.Count, '45')
+        self.assertEqual(len(pdf.pages), 45)
+        shared = set()
+        for number, page in enumerate(pdf.pages, 1):
+            content = page.Contents.stream
+            if page.Contents.Filter:
+                content = zlib.decompress(content.encode('latin-1')).decode('latin-1')
+            self.assertIn('(page {}) Tj'.format(number), content)
+            shared.add((id(page.Resources.XObject.Letterhead1), id(page.Resources.Font.F1)))
+        # the letterhead and font written with the first pages are reused
+        self.assertEqual(len(shared), 1)
+
+    def test_append(self):
+        self.check()
+
+    def test_append_object_streams(self):
+        self.check(object_streams=True, compress=6)
+
+    def test_append_without_xobjects(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plain.pdf')
+            with open(path, 'wb') as pdf:
+                PDFStreamer(HTMLParser(lambda: iter(['<p>a</p>']), CSS(''))).write_to(pdf)
+            with open(path, 'ab') as pdf:
+                PDFStreamer(HTMLParser(lambda: iter(['<p>b</p>']), CSS('')), update=path).write_to(pdf)
+            pdf = PdfReader(path)
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertIn('(b) Tj', pdf.pages[1].Contents.stream)
+
+    def test_append_truetype_subsets_tagged_apart(self):
+        pdfmetrics.registerFont(TTFont('Ubuntu-Regular', os.path.join(FONTS, 'Ubuntu-Regular.ttf')))
+        css = CSS('p { font-family: "Ubuntu-Regular"; }')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ledger.pdf')
+            with open(path, 'wb') as pdf:
+                PDFStreamer(HTMLParser(lambda: iter(['<p>äöü</p>']), css)).write_to(pdf)
+            for text in ('ßéè', 'ąćę'):
+                with open(path, 'ab') as pdf:
+                    PDFStreamer(HTMLParser(lambda: iter(['<p>{}</p>'.format(text)]), css), update=path).write_to(pdf)
+            pdf = PdfReader(path)
+        names = [font.BaseFont for page in pdf.pages for font in page.Resources.Font.values()]
+        self.assertEqual(len(names), 3)
+        self.assertEqual(len(set(names)), 3)
+
+
+def section(number, rows):
+    yield '<h1>Customer {}</h1>'.format(number)
+    yield '<table><thead><tr><td>name<td>amount</tr></thead>'
+    for i in range(rows):
+        yield '<tr><td>row {} {}<td>{}</tr>'.format(number, i, 'blah ' * 30)
+    yield '</table>'
+
+
+def heading(text):
+    yield '<h1>{}</h1>'.format(text)
+
+
+class TestShardedPDFStreamer(TestCase):
+
+    css = (
+        'h1 { page-break-before: always; } td { border-width: 1px; }'
+        '@page { letterhead-page: 1; @bottom-right { content: "Page " counter(page) " of " counter(pages); } }'
+    )
+    sections = [partial(section, number, 20) for number in range(4)]
+
+    def shown(self, page):
+        """ Strings shown on `page` and in the forms it places, in any order. """
+        streams = [page.Contents.stream]
+        for name, xobject in page.Resources.XObject.items():
+            if name.startswith('/Form'):
+                streams.append(xobject.stream)
+        return sorted(re.findall(r'\((.*?)\) Tj', ''.join(streams)))
+
+    def test_same_as_single_process(self):
+        def html():
+            for section in self.sections:
+                yield from section()
+        with tempfile.TemporaryDirectory() as directory:
+            letterhead = os.path.join(directory, 'letterhead.pdf')
+            with open(letterhead, 'wb') as pdf:
+                PDFStreamer(HTMLParser(lambda: iter(['<p>letterhead</p>']), CSS(''))).write_to(pdf)
+            data = b''.join(ShardedPDFStreamer(self.sections, HTMLParser, CSS(self.css), letterhead, workers=2))
+            expected = b''.join(PDFStreamer(HTMLParser(html, CSS(self.css)), letterhead))
+        sharded, single = PdfReader(fdata=data), PdfReader(fdata=expected)
+        self.assertEqual(sharded.Root.Pages.Count, single.Root.Pages.Count)
+        self.assertEqual(len(sharded.pages), len(single.pages))
+        self.assertGreater(len(sharded.pages), len(self.sections))
+        for sharded_page, single_page in zip(sharded.pages, single.pages):
+            self.assertEqual(self.shown(sharded_page), self.shown(single_page))
+        # fonts and the letterhead are written once
+        self.assertEqual(data.count(b'/Subtype /Type1'), expected.count(b'/Subtype /Type1'))
+        self.assertEqual(data.count(b'(letterhead) Tj'), 1)
+        self.assertEqual(len({id(page.Resources.XObject.Letterhead1) for page in sharded.pages}), 1)
+
+    def test_merged_state_released(self):
+        pdfmetrics.registerFont(TTFont('Ubuntu-Regular', os.path.join(FONTS, 'Ubuntu-Regular.ttf')))
+        font = pdfmetrics.getFont('Ubuntu-Regular')
+        css = CSS(self.css + 'h1 { font-family: "Ubuntu-Regular"; }')
+        documents = set(font.state.keys())
+        gc.disable()
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                streamer = ShardedPDFStreamer(self.sections, HTMLParser, css, executor=executor)
+                pdf = PdfReader(fdata=b''.join(streamer))
+            # the shards' and merged subsets' states are dropped without a collection
+            self.assertEqual(set(font.state.keys()), documents)
+        finally:
+            gc.enable()
+        # page numbers are the merged document's text forms
+        numbers = {key[0] for key in streamer.pdf.text_forms}
+        self.assertTrue({str(number) for number in range(1, len(pdf.pages) + 1)} <= numbers)
+
+    def test_subsets_tagged_apart(self):
+        pdfmetrics.registerFont(TTFont('Ubuntu-Regular', os.path.join(FONTS, 'Ubuntu-Regular.ttf')))
+        css = CSS(self.css + 'h1 { font-family: "Ubuntu-Regular"; }')
+        sections = [partial(heading, text) for text in ('äöü', 'ßéè', 'ąćę', 'äöü')]
+        with ThreadPoolExecutor(2) as executor:
+            pdf = PdfReader(fdata=b''.join(ShardedPDFStreamer(sections, HTMLParser, css, executor=executor)))
+        fonts = {
+            id(font): font for page in pdf.pages for font in page.Resources.Font.values()
+            if font.Subtype == '/TrueType'
+        }
+        names = [font.BaseFont for font in fonts.values()]
+        # the last section's subset is the first one's
+        self.assertEqual(len(names), 3)
+        self.assertEqual(len(set(names)), 3)
+        for font in fonts.values():
+            self.assertEqual(font.FontDescriptor.FontName, font.BaseFont)
+            self.assertIn('/CMapName /{} def'.format(font.BaseFont[1:]), font.ToUnicode.stream)
+
+
+class TestPageRange(TestCase):
+
+    def html(self):
+        for i in range(30):
+            yield '<p>page {} {}</p>'.format(i+1, chr(0x100+i))
+
+    def render(self, css='', **options):
+        streamer = PDFStreamer(HTMLParser(self.html, CSS('p { page-break-after: always; }' + css)), **options)
+        return streamer, PdfReader(fdata=b''.join(streamer))
+
+    def test_only_requested_pages(self):
+        _, full = self.render()
+        streamer, pdf = self.render(page_range=range(3, 5))
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertEqual(pdf.Root.Pages.Count, '2')
+        for page, expected in zip(pdf.pages, full.pages[2:4]):
+            self.assertEqual(page.Contents.stream, expected.Contents.stream)
+        # layout stops after the last page in the range
+        self.assertEqual(streamer.pdf.page_count, 4)
+
+    def test_glyphs_of_requested_pages(self):
+        pdfmetrics.registerFont(TTFont('Ubuntu-Regular', os.path.join(FONTS, 'Ubuntu-Regular.ttf')))
+        streamer, _ = self.render('p { font-family: "Ubuntu-Regular"; }', page_range=range(3, 5))
+        assigned = pdfmetrics.getFont('Ubuntu-Regular').state[streamer.pdf].assignments
+        self.assertEqual([code for code in assigned if code > 0xff], [0x102, 0x103])
+
+    def test_total_pages(self):
+        css = '@page { @bottom-right { content: "Page " counter(page) " of " counter(pages); } }'
+        streamer, pdf = self.render(css, page_range=[2, 7])
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertEqual(streamer.pdf.page_count, 30)
+        for page, number in zip(pdf.pages, (2, 7)):
+            self.assertIn('(page {} '.format(number), page.Contents.stream)
+            self.assertIn('({}) Tj'.format(number), page.Contents.stream)
+            self.assertIn('(30) Tj', page.Resources.XObject.Form3.stream)
+
+    def test_empty_range(self):
+        with self.assertRaises(ValueError):
+            self.render(page_range=range(1, 1))
+
+
+class TestContentStream(TestCase):
+
+    def test_number(self):
+        self.assertEqual(number(12), b'12')
+        self.assertEqual(number(12.0), b'12')
+        self.assertEqual(number(123.45678901234), b'123.457')
+        self.assertEqual(number(0.5), b'0.5')
+        self.assertEqual(number(-0.0001), b'0')
+        self.assertEqual(number(-2.25), b'-2.25')
+
+    def test_operators(self):
+        stream = ContentStream()
+        stream.op(b'Td', 0, -14.400000000000002)
+        stream.named(b'Tf', '/F1', 10)
+        stream.show('a \\(b\\)')
+        self.assertEqual(stream, b'0 -14.4 Td\n/F1 10 Tf\n(a \\(b\\)) Tj\n')
+
+
+class TestOptimize(TestCase):
+
+    def test_redundant_state(self):
+        self.assertEqual(
+            optimize(b'1 w\n0 0 0 RG\n1 w\n0 0 0 RG\n0 0 m\n1 1 l S\n1 w\n0.5 g\n0 g\n0 g\n'),
+            b'1 w\n0 0 0 RG\n0 0 m\n1 1 l\nS\n0.5 g\n0 g\n'
+        )
+
+    def test_state_restored_by_Q(self):
+        self.assertEqual(
+            optimize(b'1 w\nq\n2 w\n0 0 m\n1 1 l S\nQ\n1 w\n0 0 m\n1 1 l S\n'),
+            b'1 w\nq\n2 w\n0 0 m\n1 1 l\nS\nQ\n0 0 m\n1 1 l\nS\n'
+        )
+
+    def test_empty_blocks(self):
+        self.assertEqual(
+            optimize(b'q\n1 0 0 1 5 5 cm\n1 w\nQ\nBT\n/F1 10 Tf\n0 0 Td\nET\nBT\n/F1 10 Tf\n(a) Tj\nET\n'),
+            b'BT\n/F1 10 Tf\n(a) Tj\nET\n'
+        )
+
+    def test_text_state_outlives_ET(self):
+        self.assertEqual(
+            optimize(b'BT\n/F1 10 Tf\n(a) Tj\nET\nBT\n/F1 10 Tf\n(b) Tj\nET\n'),
+            b'BT\n/F1 10 Tf\n(a) Tj\nET\nBT\n(b) Tj\nET\n'
+        )
+
+    def test_merge_strings(self):
+        self.assertEqual(
+            optimize(b'BT\n(a \\) b) Tj\n(c) Tj\n(d) Tj\nT*\n(e) Tj\nET\n'),
+            b'BT\n[(a \\) b)(c)(d)] TJ\nT*\n(e) Tj\nET\n'
+        )
+
+    def test_move_to_line_start_after_text(self):
+        self.assertEqual(
+            optimize(b'BT\n0 0 Td\n(a) Tj\n0 0 Td\n(b) Tj\nT*\n0 0 Td\n(c) Tj\nET\n'),
+            b'BT\n(a) Tj\n0 0 Td\n(b) Tj\nT*\n(c) Tj\nET\n'
+        )
+
+
+class TestBorders(TestCase):
+
+    def test_edges_are_merged(self):
+        def html():
+            yield '<table>' + '<tr><td>a<td>b<td>c</tr>'*3 + '</table>'
+        css = CSS(
+            'table { border-collapse: collapse; border-spacing: 0 }'
+            'td { border-width: 1px; background-color: #eee }'
+        )
+        pdf = PdfReader(fdata=b''.join(PDFStreamer(HTMLParser(html, css))))
+        ops = pdf.pages[0].Contents.stream.split()
+        # one fill and one stroke per row
+        self.assertEqual(ops.count('S'), 3)
+        self.assertEqual(ops.count('RG'), 3)
+        self.assertEqual(ops.count('q'), 0)
+        # rows + 1 horizontal lines, the ones between rows drawn once, and 4 vertical lines per row
+        self.assertEqual(ops.count('m'), 4 + 3*4)
+        self.assertEqual(ops.count('re'), 9)
+        self.assertEqual(ops.count('f'), 3)
+
+    def test_text_painted_over_borders(self):
+        def html():
+            yield '<table><tr><td>a<td>b</tr><tr><td>c<td>d</tr></table>'
+        css = CSS('td { border-width: 20px; padding: 0; background-color: #eee }')
+        pdf = PdfReader(fdata=b''.join(PDFStreamer(HTMLParser(html, css))))
+        ops = pdf.pages[0].Contents.stream.split()
+        strokes = [i for i, op in enumerate(ops) if op == 'S']
+        self.assertLess(strokes[0], ops.index('(a)'))
+        self.assertLess(ops.index('(b)'), strokes[1])
+        self.assertLess(strokes[1], ops.index('(c)'))
@@ -2,15 +2,16 @@ from unittest import TestCase
 from bericht.html import HTMLParser, CSS
 
 
-def parse_html(html, css=None):
+def parse_html(html, css=None, lookahead=None):
     return HTMLParser(
         lambda: iter(html if isinstance(html, list) else [html]),
-        css if isinstance(css, CSS) else CSS(css or '')
+        css if isinstance(css, CSS) else CSS(css or ''),
+        lookahead
     )
 
 
 class BaseTestCase(TestCase):
 
     @staticmethod
-    def parse(html, css=None):
-        return parse_html(html, css)
+    def parse(html, css=None, lookahead=None):
+        return parse_html(html, css, lookahead)